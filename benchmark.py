@@ -0,0 +1,170 @@
+import matplotlib
+matplotlib.use('Agg')
+
+import argparse
+import functools
+import json
+import logging
+import os
+import platform
+import subprocess
+import tempfile
+from datetime import datetime, timezone
+
+import bike_stats
+import pyviz_joke_stats
+import top_20
+from joke_clustering import update_alias_table
+from joke_companions import companion_frequencies
+from joke_transitions import preceding_joke_pairs
+from profiling import add_profile_arguments, enable_from_args, row_count, stage
+from synthetic_data import generate_crashes, generate_jokes
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def git_commit():
+    """
+    Return the commit hash of the checked out code, with a '-dirty' suffix for uncommitted changes.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if dirty else '')
+
+
+def measure(results, pipeline, size, name, func, *args, **kwargs):
+    """
+    Run one pipeline stage, append its profile (wall time, CPU time, peak memory, output rows) to results,
+    and return its value.
+    """
+    with stage(f"{pipeline}.{name}", size=size) as record:
+        value = func(*args, **kwargs)
+        record.rows = row_count(value)
+    results.append({'pipeline': pipeline, 'size': size, 'stage': name, **record.as_dict()})
+    return value
+
+
+def run_jokes(results, size, seed=0):
+    """
+    Benchmark the joke pipelines on a synthetic table of about size rows. Runs in the working directory,
+    where the scripts write their caches and CSVs.
+    """
+    run = functools.partial(measure, results, 'jokes', size)
+    jokes = run('generate', generate_jokes, size, seed=seed)
+    jokeids = jokes['jokeid'].cat.categories
+
+    # pyviz_joke_stats.py: preceding pairs, fuzzy grouping, best predecessor. An empty cache directory
+    # makes the transition table be built rather than read back from an earlier run
+    with tempfile.TemporaryDirectory(dir='.') as cache_dir:
+        pairs = run('preceding_pairs', preceding_joke_pairs, jokes, cache_dir=cache_dir)
+    grouped = run('fuzzy_group_jokes', pyviz_joke_stats.fuzzy_group_jokes, pairs)
+    run('analyze_jokes', pyviz_joke_stats.analyze_jokes, grouped)
+
+    # joke_stats.py and top_20.py: alias table, companions, pair scores
+    alias_path = f"joke_aliases-{size}.json"
+    jokeid_to_group = run('alias_table', update_alias_table, jokeids, alias_path, recluster=True)
+    run('companions', companion_frequencies, jokes, jokeid_to_group)
+    run('pair_scores', top_20.build_pair_scores, jokes, alias_path)
+
+
+def run_crashes(results, size, seed=0, chunksize=1_000_000, in_memory_limit=2_000_000):
+    """
+    Benchmark the bike_stats.py loaders on a synthetic crash CSV of size rows. The CSV is generated once
+    per size and seed and reused by later runs.
+    """
+    run = functools.partial(measure, results, 'crashes', size)
+    csv_path = f"crashes-{size}-{seed}.csv"
+    if not os.path.exists(csv_path):
+        run('generate', generate_crashes, csv_path + '.tmp', size, seed=seed)
+        os.replace(csv_path + '.tmp', csv_path)
+
+    if size <= in_memory_limit:
+        run('load_in_memory', bike_stats.load_in_memory, csv_path, '%m/%d/%Y')
+    run('load_streaming', bike_stats.load_streaming, csv_path, chunksize, '%m/%d/%Y')
+    parquet_dir = f"crashes-{size}-{seed}_parquet"
+    run('convert_to_parquet', bike_stats.convert_to_parquet, csv_path, parquet_dir, chunksize, '%m/%d/%Y')
+    run('load_parquet', bike_stats.load_parquet, parquet_dir)
+
+
+def compare(results, baseline_path, tolerance=1.25):
+    """
+    Print the wall time of every stage against a baseline results file, flagging slowdowns beyond tolerance.
+    Returns the number of regressions.
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {(r['pipeline'], r['size'], r['stage']): r for r in baseline['results']}
+
+    regressions = 0
+    print(f"Compared with {baseline_path} (commit {baseline.get('commit')}):")
+    for result in results:
+        old = previous.get((result['pipeline'], result['size'], result['stage']))
+        if old is None or not old['seconds']:
+            continue
+        ratio = result['seconds'] / old['seconds']
+        flag = ''
+        if ratio > tolerance and result['seconds'] - old['seconds'] > 0.05:
+            flag = '  REGRESSION'
+            regressions += 1
+        print(f"  {result['pipeline']:8} {result['size']:>10} {result['stage']:20} "
+              f"{old['seconds']:9.3f}s -> {result['seconds']:9.3f}s  x{ratio:.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time and memory-profile every pipeline stage on synthetic data of growing size.')
+    parser.add_argument('--joke_sizes', type=int, nargs='*', default=[10_000, 100_000], help='Row counts of the synthetic jokes tables.')
+    parser.add_argument('--crash_sizes', type=int, nargs='*', default=[10_000, 1_000_000, 10_000_000], help='Row counts of the synthetic crash CSVs.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the data generators.')
+    parser.add_argument('--chunksize', type=int, default=1_000_000, help='Chunk size of the streaming and Parquet crash loaders.')
+    parser.add_argument('--in_memory_limit', type=int, default=2_000_000, help='Largest crash CSV to also load all at once.')
+    parser.add_argument('--workdir', default=os.path.join('cache', 'benchmark'), help='Directory for the generated data and script outputs.')
+    parser.add_argument('--out', help='Path of the JSON results (default: benchmarks/<commit>.json).')
+    parser.add_argument('--compare', help='Results file of an earlier run to compare the wall times with.')
+    parser.add_argument('--tolerance', type=float, default=1.25, help='Slowdown ratio over the baseline reported as a regression.')
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    enable_from_args(args)
+
+    commit = git_commit()
+    out = os.path.abspath(args.out or os.path.join('benchmarks', f"{(commit or 'unknown')[:12]}.json"))
+    baseline = os.path.abspath(args.compare) if args.compare else None
+
+    os.makedirs(args.workdir, exist_ok=True)
+    cwd = os.getcwd()
+    os.chdir(args.workdir)
+    results = []
+    try:
+        for size in args.joke_sizes:
+            run_jokes(results, size, args.seed)
+        for size in args.crash_sizes:
+            run_crashes(results, size, args.seed, args.chunksize, args.in_memory_limit)
+    finally:
+        os.chdir(cwd)
+
+    report = {
+        'commit': commit,
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'seed': args.seed,
+        'results': results,
+    }
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} stage results to {out}")
+
+    if baseline and compare(results, baseline, args.tolerance):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
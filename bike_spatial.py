@@ -0,0 +1,112 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+EARTH_RADIUS_M = 6_371_000.0
+
+# Latitude the local projection is scaled at; fixed so cells from different runs and chunks line up
+REFERENCE_LATITUDE = 40.7
+
+INJURY_COLUMNS = ['Cyclists Injured', 'Cyclists Killed']
+
+
+def to_metres(lat, lon):
+    """
+    Project coordinates onto a local equirectangular plane in metres.
+    """
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    return EARTH_RADIUS_M * lon * np.cos(np.radians(REFERENCE_LATITUDE)), EARTH_RADIUS_M * lat
+
+
+def to_degrees(x, y):
+    """
+    Inverse of to_metres.
+    """
+    lat = np.degrees(y / EARTH_RADIUS_M)
+    lon = np.degrees(x / (EARTH_RADIUS_M * np.cos(np.radians(REFERENCE_LATITUDE))))
+    return lat, lon
+
+
+def _pack(i, j):
+    return (i.astype(np.int64) << 32) | (j.astype(np.int64) & 0xFFFFFFFF)
+
+
+def _unpack(cells):
+    cells = np.asarray(cells, dtype=np.int64)
+    return cells >> 32, (cells & 0xFFFFFFFF).astype(np.uint32).astype(np.int32)
+
+
+def bin_coordinates(lat, lon, cell_size=250, kind='grid'):
+    """
+    Assign every coordinate to a cell and return int64 cell IDs.
+    kind is 'grid' (square cells with cell_size metre sides) or 'hex' (pointy-top hexagons with a
+    cell_size metre circumradius).
+    """
+    x, y = to_metres(lat, lon)
+    if kind == 'grid':
+        return _pack(np.floor(x / cell_size), np.floor(y / cell_size))
+    if kind != 'hex':
+        raise ValueError(f"Unknown cell kind '{kind}'")
+
+    # Fractional axial coordinates, then cube rounding to the nearest hexagon
+    q = (np.sqrt(3) / 3 * x - y / 3) / cell_size
+    r = (2 / 3 * y) / cell_size
+    s = -q - r
+    rq, rr, rs = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    rq = np.where(fix_q, -rr - rs, rq)
+    rr = np.where(fix_r, -rq - rs, rr)
+    return _pack(rq, rr)
+
+
+def cell_centres(cells, cell_size=250, kind='grid'):
+    """
+    Return the (x, y) centroid in metres of every cell ID.
+    """
+    i, j = _unpack(cells)
+    if kind == 'grid':
+        return (i + 0.5) * cell_size, (j + 0.5) * cell_size
+    return cell_size * (np.sqrt(3) * i + np.sqrt(3) / 2 * j), cell_size * 1.5 * j
+
+
+def aggregate_cells(df, cell_size=250, kind='grid'):
+    """
+    Sum injuries and deaths and count accidents per spatial cell. Rows without coordinates are left out.
+    """
+    located = df.dropna(subset=['Latitude', 'Longitude'])
+    cells = bin_coordinates(located['Latitude'].to_numpy(), located['Longitude'].to_numpy(), cell_size, kind)
+    grouped = located[INJURY_COLUMNS].groupby(cells)
+    sums = grouped.sum().astype('int64')
+    sums['count'] = grouped.size().astype('int64')
+    sums.index.name = 'cell'
+    return sums
+
+
+def build_index(cells, cell_size=250, kind='grid'):
+    """
+    Build a spatial index over aggregated cells: adds centroid coordinates to the cell frame and
+    returns (cells, KD-tree over the centroids in metres).
+    """
+    x, y = cell_centres(cells.index.to_numpy(), cell_size, kind)
+    lat, lon = to_degrees(x, y)
+    cells = cells.assign(Latitude=lat, Longitude=lon)
+    return cells, cKDTree(np.column_stack([x, y]))
+
+
+def top_hotspots(cells, k=10, by='Cyclists Injured'):
+    """
+    Return the k cells with the most injuries (or the given column).
+    """
+    return cells.nlargest(k, by)
+
+
+def injuries_within(cells, tree, lat, lon, radius_m):
+    """
+    Sum injuries, deaths and accidents over the cells whose centroid is within radius_m metres of a point.
+    The answer is exact to the resolution of the cells.
+    """
+    x, y = to_metres(lat, lon)
+    nearby = tree.query_ball_point([float(x), float(y)], r=radius_m)
+    return cells.iloc[sorted(nearby)][INJURY_COLUMNS + ['count']].sum()
@@ -1,140 +1,432 @@
+import numpy as np
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
 import logging
+import argparse
+import os
+import shutil
+from bike_spatial import aggregate_cells, build_index, top_hotspots, injuries_within
+from profiling import add_profile_arguments, enable_from_args, log_every, profiled
+from time_series import parse_window, period_window, resample, rolling_mean
 
-# Set up logging
-logging.basicConfig(filename='cyclist_accidents.log', level=logging.DEBUG,
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+INJURY_COLUMNS = ['Cyclists Injured', 'Cyclists Killed']
+CUBE_KEYS = ['DayOfWeek', 'Hour', 'Borough', 'Contributing Factor']
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
 
-# Load the dataset from CSV file
-df = pd.read_csv('cyclist_accidents.csv')
+# Rows per Parquet row group; the partitions are sorted by date, so a date filter skips whole row groups
+ROW_GROUP_ROWS = 100_000
 
-# Convert 'Date' to datetime format
-df['Date'] = pd.to_datetime(df['Date'], errors='coerce')  # Handle invalid dates
+# Columns the analysis needs and the compact dtypes they are read with in streaming mode
+ANALYSIS_DTYPES = {
+    'Date': 'string',
+    'Time': 'string',
+    'Borough': 'category',
+    'Cyclists Injured': 'Int16',
+    'Cyclists Killed': 'Int16',
+    'Latitude': 'float64',
+    'Longitude': 'float64',
+    'Contributing Factor': 'category',
+}
 
-# Convert 'Time' to datetime, using format '%H:%M:%S' to match the data
-df['Time'] = pd.to_datetime(df['Time'], format='%H:%M:%S', errors='coerce')
+def prepare(df, date_format=None):
+    """
+    Parse 'Date' and 'Time', drop rows with an invalid time and add the 'Hour' and 'DayOfWeek' codes
+    (0 = Monday). With a date_format the dates are parsed with that fixed format instead of inferring it.
+    """
+    # Convert 'Date' to datetime format
+    dates = pd.to_datetime(df['Date'], format=date_format, errors='coerce')  # Handle invalid dates
 
-# Drop rows where 'Time' is NaT (invalid/missing)
-df_clean = df.dropna(subset=['Time'])
+    # Convert 'Time' to datetime, using format '%H:%M:%S' to match the data
+    times = pd.to_datetime(df['Time'], format='%H:%M:%S', errors='coerce')
 
-# Extract the hour from 'Time'
-df_clean['Hour'] = df_clean['Time'].dt.hour
+    # Drop rows where 'Time' is NaT (invalid/missing)
+    valid = times.notna()
+    df_clean = df[valid].copy()
+    df_clean['Date'] = dates[valid]
 
-# Create the 'DayOfWeek' column based on 'Date'
-df_clean['DayOfWeek'] = df_clean['Date'].dt.day_name()
+    # Extract the hour and day of the week as small integer codes
+    df_clean['Hour'] = times[valid].dt.hour.astype('int8')
+    df_clean['DayOfWeek'] = df_clean['Date'].dt.dayofweek.astype('Int8')
+    return df_clean
 
-# Check for missing values in key columns after cleaning
-missing_values = df_clean[['Cyclists Injured', 'Cyclists Killed', 'Hour', 'DayOfWeek', 'Borough']].isnull().sum()
-logging.debug("\nMissing values in key columns after cleaning:")
-logging.debug(missing_values)
+def _plain_index(index):
+    """
+    Replace categorical index levels with plain ones, so partial results from different chunks
+    (each with its own categories) line up when they are added together.
+    """
+    levels = [index.get_level_values(i) for i in range(index.nlevels)]
+    levels = [level.astype(object) if isinstance(level.dtype, pd.CategoricalDtype) else level for level in levels]
+    return pd.MultiIndex.from_arrays(levels) if len(levels) > 1 else levels[0]
 
-# Log a sample of the clean dataset to verify the data
-logging.debug("\nSample of cleaned data:")
-logging.debug(df_clean[['Date', 'Time', 'Hour', 'DayOfWeek', 'Borough', 'Cyclists Injured', 'Cyclists Killed']].head(10))
+@profiled('aggregation')
+def aggregate(df_clean, cell_size=250, cell_kind='grid'):
+    """
+    Aggregate a cleaned frame (or one chunk of it) in a single scan: a DayOfWeek x Hour x Borough x
+    Contributing Factor cube of injury/death sums and accident counts, plus the same sums per spatial cell.
+    Missing keys are kept as their own cells so every breakdown can be rolled up from the cube.
+    """
+    grouped = df_clean.groupby(CUBE_KEYS, observed=True, dropna=False)
+    cube = grouped[INJURY_COLUMNS].sum().astype('int64')
+    cube['count'] = grouped.size().astype('int64')
+    cube.index = _plain_index(cube.index)
 
-# Calculate the 'Chances of Death or Injury'
-total_injuries_deaths = df_clean.groupby(['DayOfWeek', 'Hour'])[['Cyclists Injured', 'Cyclists Killed']].sum()
-total_events_by_day_hour = df_clean.groupby(['DayOfWeek', 'Hour']).size()
-chances_of_injury_or_death = total_injuries_deaths.sum(axis=1) / total_events_by_day_hour
+    return {'cube': cube, 'cells': aggregate_cells(df_clean, cell_size, cell_kind)}
 
-# Merge the chances back into the original dataframe
-df_clean = df_clean.merge(chances_of_injury_or_death.reset_index(name='Chances of Death or Injury'),
-                          on=['DayOfWeek', 'Hour'], how='left')
+def fold(totals, partial):
+    """
+    Add the aggregates of one chunk into the running totals.
+    """
+    if totals is None:
+        return partial
+    return {name: totals[name].add(partial[name], fill_value=0).astype('int64') for name in totals}
 
-# Save the updated DataFrame to a new CSV file
-df_clean.to_csv('cyclist_accidents_with_chances.csv', index=False)
+def breakdowns(totals):
+    """
+    Roll the cube up into every breakdown the dashboard needs. Each rollup drops the rows whose own
+    keys are missing, exactly as a groupby over the full data would.
+    """
+    cube = totals['cube']
+    return {
+        'cube': cube,
+        'day_hour': cube.groupby(level=['DayOfWeek', 'Hour']).sum(),
+        'hour': cube.groupby(level='Hour')[INJURY_COLUMNS].sum(),
+        'day': cube.groupby(level='DayOfWeek')[INJURY_COLUMNS].sum(),
+        'borough': cube.groupby(level='Borough')[INJURY_COLUMNS].sum(),
+        'cells': totals['cells'],
+        'factor': cube.groupby(level='Contributing Factor')[INJURY_COLUMNS].sum(),
+    }
 
-# Log success message
-logging.debug("Updated DataFrame with 'Chances of Death or Injury' column has been saved to 'cyclist_accidents_with_chances.csv'.")
+def chances_by_day_hour(aggregates):
+    """
+    Calculate the 'Chances of Death or Injury' per (DayOfWeek, Hour): injuries and deaths per accident.
+    """
+    day_hour = aggregates['day_hour']
+    return day_hour[INJURY_COLUMNS].sum(axis=1) / day_hour['count']
 
-# Group by 'Hour' and aggregate injuries and deaths
-injuries_by_hour = df_clean.groupby('Hour')[['Cyclists Injured', 'Cyclists Killed']].sum()
-logging.debug("\nInjuries by Hour (aggregated):")
-logging.debug(injuries_by_hour)
+def attach_chances(df_clean, chances):
+    """
+    Attach the chances to every cleaned row by indexing a flat DayOfWeek x Hour lookup table,
+    with day names for output.
+    """
+    table = np.full(len(DAY_NAMES) * 24, np.nan)
+    days = chances.index.get_level_values('DayOfWeek').to_numpy(dtype=int)
+    hours = chances.index.get_level_values('Hour').to_numpy(dtype=int)
+    table[days * 24 + hours] = chances.to_numpy()
 
-# Group by 'DayOfWeek' and aggregate injuries and deaths
-injuries_by_day = df_clean.groupby('DayOfWeek')[['Cyclists Injured', 'Cyclists Killed']].sum()
-logging.debug("\nInjuries by Day of the Week (aggregated):")
-logging.debug(injuries_by_day)
+    day = df_clean['DayOfWeek'].to_numpy(dtype=float, na_value=np.nan)
+    slot = np.where(np.isnan(day), 0, day * 24 + df_clean['Hour'].to_numpy()).astype(int)
+    df_clean = df_clean.copy()
+    df_clean['Chances of Death or Injury'] = np.where(np.isnan(day), np.nan, table[slot])
+    df_clean['DayOfWeek'] = df_clean['DayOfWeek'].map(dict(enumerate(DAY_NAMES)))
+    return df_clean
 
-# Group by 'Borough' and aggregate injuries and deaths
-injuries_by_borough = df_clean.groupby('Borough')[['Cyclists Injured', 'Cyclists Killed']].sum()
-logging.debug("\nInjuries by Borough (aggregated):")
-logging.debug(injuries_by_borough)
+@profiled('load_in_memory')
+def load_in_memory(path, date_format=None, cell_size=250, cell_kind='grid'):
+    """
+    Read and aggregate the whole CSV at once, writing the enriched rows to 'cyclist_accidents_with_chances.csv'.
+    """
+    # Load the dataset from CSV file
+    df = pd.read_csv(path)
+    df_clean = prepare(df, date_format)
 
-# Group by 'Latitude' and 'Longitude' and aggregate injuries and deaths
-injuries_by_location = df_clean.groupby(['Latitude', 'Longitude'])[['Cyclists Injured', 'Cyclists Killed']].sum()
-logging.debug("\nInjuries by Location (aggregated):")
-logging.debug(injuries_by_location)
+    # Check for missing values in key columns after cleaning
+    missing_values = df_clean[['Cyclists Injured', 'Cyclists Killed', 'Hour', 'DayOfWeek', 'Borough']].isnull().sum()
+    logging.debug("\nMissing values in key columns after cleaning:")
+    logging.debug(missing_values)
 
-# Group by 'Contributing Factor' and aggregate injuries and deaths
-factors = df_clean.groupby('Contributing Factor')[['Cyclists Injured', 'Cyclists Killed']].sum()
-logging.debug("\nInjuries by Contributing Factor (aggregated):")
-logging.debug(factors)
+    # Log a sample of the clean dataset to verify the data
+    logging.debug("\nSample of cleaned data:")
+    logging.debug(df_clean[['Date', 'Time', 'Hour', 'DayOfWeek', 'Borough', 'Cyclists Injured', 'Cyclists Killed']].head(10))
 
-# Get top 5 contributing factors by number of cyclist injuries
-top_factors = factors.sort_values(by='Cyclists Injured', ascending=False).head(5)
+    aggregates = breakdowns(aggregate(df_clean, cell_size, cell_kind))
 
-# Reformat for labeling graph
-logging.debug("\nTop 5 Contributing Factors:")
-logging.debug(top_factors)
+    # Save the updated DataFrame to a new CSV file
+    attach_chances(df_clean, chances_by_day_hour(aggregates)).to_csv('cyclist_accidents_with_chances.csv', index=False)
+    return aggregates
 
-# Create a dictionary for label replacement
-label_replacement = {
-    'Pedestrian/Bicyclist/Other Pedestrian Error/Confusion': 'Pedestrian Error',
-    'Driver Inattention/Distraction': 'Driver Inattention',
-    'Failure to Yield Right-of-Way': 'Ignored Right-of-Way',
-    'Traffic Control Disregarded' : 'Traffic Control Ignored'
-}
+@profiled('load_streaming')
+def load_streaming(path, chunksize, date_format=None, cell_size=250, cell_kind='grid'):
+    """
+    Read the CSV in chunks with compact dtypes, folding each chunk into the aggregates and dropping it,
+    so peak memory depends on the number of groups rather than the number of rows. The enriched rows are
+    written to 'cyclist_accidents_with_chances.csv' in a second chunked pass.
+    """
+    totals = None
+    rows = 0
+    for chunk in pd.read_csv(path, usecols=list(ANALYSIS_DTYPES), dtype=ANALYSIS_DTYPES, chunksize=chunksize):
+        totals = fold(totals, aggregate(prepare(chunk, date_format), cell_size, cell_kind))
+        rows += len(chunk)
+        log_every(10, rows // chunksize, logging.DEBUG, "Aggregated %d rows.", rows)
+    logging.debug("Aggregated %d rows in chunks of %d.", rows, chunksize)
+    aggregates = breakdowns(totals)
+
+    # Save the updated rows to a new CSV file, one chunk at a time
+    chances = chances_by_day_hour(aggregates)
+    header = True
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        enriched = attach_chances(prepare(chunk, date_format), chances)
+        enriched.to_csv('cyclist_accidents_with_chances.csv', mode='w' if header else 'a', header=header, index=False)
+        header = False
+    return aggregates
+
+def _year_partitions(parquet_dir):
+    """
+    The (year, directory) of every year partition of the Parquet dataset, in year order.
+    """
+    partitions = []
+    for name in os.listdir(parquet_dir):
+        # A sort interrupted between swapping the directories leaves the original under a hidden name: it
+        # is restored when the sorted copy did not make it in place, and dropped when it did
+        if name.startswith('.') and name.endswith('.old'):
+            if os.path.exists(os.path.join(parquet_dir, name[1:-4])):
+                shutil.rmtree(os.path.join(parquet_dir, name))
+                continue
+            os.replace(os.path.join(parquet_dir, name), os.path.join(parquet_dir, name[1:-4]))
+            name = name[1:-4]
+        key, _, year = name.partition('=')
+        if key == 'Year' and year.isdigit() and os.path.isdir(os.path.join(parquet_dir, name)):
+            partitions.append((int(year), os.path.join(parquet_dir, name)))
+    return sorted(partitions)
+
+def sort_partitions(parquet_dir, row_group_size=ROW_GROUP_ROWS):
+    """
+    Rewrite every year partition as one file sorted by 'Date', in row groups whose date ranges do not
+    overlap. Only one year is held in memory at a time. The sorted file is written to a hidden directory
+    (which readers skip) and swapped in by renames, so a crash never leaves a year missing or doubled.
+    """
+    for year, path in _year_partitions(parquet_dir):
+        partition = pd.read_parquet(path).sort_values('Date', kind='stable', ignore_index=True)
+        parent, name = os.path.split(path)
+        sorted_path, old_path = os.path.join(parent, f'.{name}.sorted'), os.path.join(parent, f'.{name}.old')
+        shutil.rmtree(sorted_path, ignore_errors=True)
+        os.makedirs(sorted_path)
+        partition.to_parquet(os.path.join(sorted_path, 'part-0.parquet'), index=False, row_group_size=row_group_size)
+        os.replace(path, old_path)
+        os.replace(sorted_path, path)
+        shutil.rmtree(old_path)
+        logging.debug("Sorted %d rows of %d by date.", len(partition), year)
+
+def latest_date(parquet_dir):
+    """
+    Last accident date in the Parquet dataset, read from the newest year partition only.
+    """
+    partitions = _year_partitions(parquet_dir)
+    return pd.read_parquet(partitions[-1][1], columns=['Date'])['Date'].max() if partitions else None
+
+def window_filters(years=None, start=None, end=None):
+    """
+    Parquet filters for the given years and the [start, end) date window. The year partitions outside the
+    window are pruned by their directory names; inside a partition the date bounds skip row groups.
+    """
+    filters = []
+    if years is not None:
+        filters.append(('Year', 'in', list(years)))
+    if start is not None:
+        filters += [('Year', '>=', start.year), ('Date', '>=', start)]
+    if end is not None:
+        filters += [('Year', '<=', (end - pd.Timedelta(days=1)).year), ('Date', '<', end)]
+    return filters or None
+
+@profiled('convert_to_parquet')
+def convert_to_parquet(csv_path, parquet_dir, chunksize=1_000_000, date_format=None):
+    """
+    Convert the CSV export into a Parquet dataset partitioned by year, with the cleaned 'Date' and the
+    derived 'Hour' and 'DayOfWeek' columns already computed. The CSV is read in chunks, so memory stays flat.
+    Every partition is then sorted by date, so time windows read only the row groups they cover.
+    """
+    shutil.rmtree(parquet_dir, ignore_errors=True)
+    dtypes = {column: dtype for column, dtype in ANALYSIS_DTYPES.items() if column not in ('Date', 'Time')}
+    rows = 0
+    for chunk in pd.read_csv(csv_path, dtype=dtypes, chunksize=chunksize):
+        df_clean = prepare(chunk, date_format)
+        df_clean['Year'] = df_clean['Date'].dt.year.astype('Int16')
+        df_clean.to_parquet(parquet_dir, partition_cols=['Year'], index=False)
+        rows += len(df_clean)
+    sort_partitions(parquet_dir)
+    logging.debug("Converted %d cleaned rows from %s to %s.", rows, csv_path, parquet_dir)
+
+@profiled('load_parquet')
+def load_parquet(parquet_dir, years=None, cell_size=250, cell_kind='grid', start=None, end=None):
+    """
+    Read only the analysis columns, and only the partitions of the given years and the [start, end) date
+    window, from the Parquet dataset. The enriched rows are written to 'cyclist_accidents_with_chances.parquet'.
+    """
+    columns = ['Date', 'Hour', 'DayOfWeek'] + [column for column in ANALYSIS_DTYPES if column not in ('Date', 'Time')]
+    filters = window_filters(years, start, end)
+    df_clean = pd.read_parquet(parquet_dir, columns=columns, filters=filters)
+    logging.debug("Read %d rows from %s.", len(df_clean), parquet_dir)
+
+    aggregates = breakdowns(aggregate(df_clean, cell_size, cell_kind))
+    attach_chances(df_clean, chances_by_day_hour(aggregates)).to_parquet('cyclist_accidents_with_chances.parquet', index=False)
+    return aggregates
+
+@profiled('trend')
+def injury_trend(parquet_dir, freq='M', years=None, start=None, end=None, rolling=1):
+    """
+    Cyclists injured per period (a pandas period frequency such as 'W', 'M' or 'Q') and borough, read from
+    only the partitions and row groups of the window, widened to whole periods. With rolling > 1 every
+    period holds the mean per period over the last rolling periods instead.
+    """
+    start, end = period_window(start, end, freq)
+    filters = window_filters(years, start, end)
+    df = pd.read_parquet(parquet_dir, columns=['Date', 'Borough', 'Cyclists Injured'], filters=filters)
+    df = df[df['Date'].notna()]
+    boroughs = df['Borough'].astype('category')
+    periods, sums, counts = resample(df['Date'], df['Cyclists Injured'].to_numpy(dtype=float, na_value=np.nan), freq,
+                                     groups=boroughs.cat.codes.to_numpy(), n_groups=len(boroughs.cat.categories),
+                                     start=start, end=end)
+    if rolling > 1 and len(periods):
+        # Mean injuries per period over the window, not per accident
+        sums = rolling_mean(sums, np.ones(sums.shape), rolling)
+    trend = pd.DataFrame(sums, index=pd.Index(periods, name='period'), columns=pd.Index(boroughs.cat.categories, name='Borough'))
+    logging.debug("Aggregated %d rows into %d periods.", len(df), len(periods))
+    return trend
+
+@profiled('render')
+def plot_dashboard(aggregates, path='cyclist_accidents_analysis.png'):
+    """
+    Plot injuries by hour, day of the week, borough and top contributing factors on one figure.
+    """
+    injuries_by_hour = aggregates['hour'].sort_index()
+    injuries_by_day = aggregates['day'].sort_index().rename(index=dict(enumerate(DAY_NAMES)))
+    injuries_by_borough = aggregates['borough'].sort_index()
+    factors = aggregates['factor']
+
+    # Get top 5 contributing factors by number of cyclist injuries
+    top_factors = factors.sort_values(by='Cyclists Injured', ascending=False).head(5)
+
+    # Reformat for labeling graph
+    logging.debug("\nTop 5 Contributing Factors:")
+    logging.debug(top_factors)
+
+    # Create a dictionary for label replacement
+    label_replacement = {
+        'Pedestrian/Bicyclist/Other Pedestrian Error/Confusion': 'Pedestrian Error',
+        'Driver Inattention/Distraction': 'Driver Inattention',
+        'Failure to Yield Right-of-Way': 'Ignored Right-of-Way',
+        'Traffic Control Disregarded' : 'Traffic Control Ignored'
+    }
+
+    # Replace labels in the index of the top_factors DataFrame
+    top_factors.index = [label_replacement.get(x, x) for x in top_factors.index]
+
+    # Plotting all graphs
+    plt.figure(figsize=(18, 12))
+
+    # Injuries by Hour
+    plt.subplot(2, 2, 1)
+    sns.barplot(x=injuries_by_hour.index, y=injuries_by_hour['Cyclists Injured'])
+    plt.title('Cyclist Injuries by Hour')
+    plt.xlabel('Hour of the Day')
+    plt.ylabel('Number of Cyclist Injuries')
+    plt.xticks(rotation=45)
+
+    # Injuries by Day of the Week
+    plt.subplot(2, 2, 2)
+    sns.barplot(x=injuries_by_day.index, y=injuries_by_day['Cyclists Injured'])
+    plt.title('Cyclist Injuries by Day of the Week')
+    plt.xlabel('Day of the Week')
+    plt.ylabel('Number of Cyclist Injuries')
+    plt.xticks(rotation=25)
+
+    # Injuries by Borough
+    plt.subplot(2, 2, 3)
+    sns.barplot(x=injuries_by_borough.index, y=injuries_by_borough['Cyclists Injured'])
+    plt.title('Cyclist Injuries by Borough')
+    plt.xlabel('Borough')
+    plt.ylabel('Number of Cyclist Injuries')
+    plt.xticks(rotation=25)
+
+    # Top 5 Injuries by Contributing Factor
+    plt.subplot(2, 2, 4)
+    ax = sns.barplot(x=top_factors.index, y=top_factors['Cyclists Injured'])
+    plt.title('Cyclist Injuries by Contributing Factor')
+    plt.xlabel('Contributing Factor')
+    plt.ylabel('Number of Cyclist Injuries')
+
+    # Align x-axis labels with tick marks
+    ax.set_xticks(range(len(top_factors.index)))
+    ax.set_xticklabels(top_factors.index, rotation=25, ha='right')
+
+    # Adjust layout with padding
+    plt.subplots_adjust(left=0.1, right=0.9, top=0.9, bottom=0.22, wspace=0.7, hspace=0.7)  # Add space between plots and margins
+
+    # Save the figure
+    plt.savefig(path)
+
+def main():
+    parser = argparse.ArgumentParser(description='Analyze when and where cyclists are most likely to get injured.')
+    parser.add_argument('--csv', default='cyclist_accidents.csv', help='Path of the cyclist accidents CSV export.')
+    parser.add_argument('--chunksize', type=int, help='Stream the CSV in chunks of this many rows instead of loading it all at once.')
+    parser.add_argument('--source', choices=['csv', 'parquet'], default='csv', help='Read the CSV export, or the year-partitioned Parquet dataset converted from it.')
+    parser.add_argument('--parquet', default='cyclist_accidents_parquet', help='Directory of the year-partitioned Parquet dataset.')
+    parser.add_argument('--convert', action='store_true', help='Convert the CSV export into the Parquet dataset before analysing it.')
+    parser.add_argument('--years', type=int, nargs='+', help='Only analyse these years (Parquet source only).')
+    parser.add_argument('--start', help='Only analyse accidents on or after this date (Parquet source only).')
+    parser.add_argument('--end', help='Only analyse accidents before this date (Parquet source only).')
+    parser.add_argument('--last', help='Only analyse this much time before the last accident, e.g. 6M or 1Y (Parquet source only).')
+    parser.add_argument('--trend', metavar='FREQ', help="Also report cyclists injured per borough per period, e.g. 'W', 'M' or 'Q' (Parquet source only).")
+    parser.add_argument('--rolling', type=int, default=1, help='Average the trend over this many periods.')
+    parser.add_argument('--cell_size', type=float, default=250, help='Size in metres of the spatial cells accidents are binned into.')
+    parser.add_argument('--cell_kind', choices=['grid', 'hex'], default='grid', help='Square grid cells or hexagonal cells.')
+    parser.add_argument('--hotspots', type=int, default=10, help='Number of top hotspot cells to report.')
+    parser.add_argument('--near', type=float, nargs=3, metavar=('LAT', 'LON', 'RADIUS'), help='Report injuries within RADIUS metres of a point.')
+    parser.add_argument('--headless', action='store_true', help='Only save the dashboard, without opening a window.')
+    parser.add_argument('--date_format', help="Fixed strptime format of the 'Date' column (e.g. '%%m/%%d/%%Y'); inferred when omitted.")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    if args.rolling < 1:
+        parser.error('--rolling must be at least 1')
+
+    # Set up logging
+    logging.basicConfig(filename='cyclist_accidents.log', level=logging.DEBUG,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    enable_from_args(args)
+
+    if args.convert:
+        convert_to_parquet(args.csv, args.parquet, args.chunksize or 1_000_000, args.date_format)
+
+    windowed = args.years or args.start or args.end or args.last or args.trend
+    if windowed and args.source != 'parquet':
+        parser.error('--years, --start, --end, --last and --trend need --source parquet')
+    start, end = parse_window(args.start, args.end, args.last, latest_date(args.parquet) if args.last else None)
+
+    spatial = {'cell_size': args.cell_size, 'cell_kind': args.cell_kind}
+    if args.source == 'parquet':
+        aggregates = load_parquet(args.parquet, args.years, start=start, end=end, **spatial)
+    elif args.chunksize:
+        aggregates = load_streaming(args.csv, args.chunksize, args.date_format, **spatial)
+    else:
+        aggregates = load_in_memory(args.csv, args.date_format, **spatial)
+
+    # Index the spatial cells and report the hotspots
+    cells, tree = build_index(aggregates['cells'], args.cell_size, args.cell_kind)
+    print(f"Top {args.hotspots} hotspot cells ({args.cell_kind}, {args.cell_size:g} m):")
+    print(top_hotspots(cells, args.hotspots))
+    if args.near:
+        lat, lon, radius = args.near
+        print(f"Injuries within {radius:g} m of ({lat}, {lon}):")
+        print(injuries_within(cells, tree, lat, lon, radius))
+
+    if args.trend:
+        print(f"Cyclists injured per {args.trend} and borough:")
+        print(injury_trend(args.parquet, args.trend, args.years, start, end, args.rolling).round(2).to_string())
+
+    # Log success message
+    logging.debug("Updated DataFrame with 'Chances of Death or Injury' column has been saved.")
+
+    # Log the aggregated breakdowns
+    for name, title in [('hour', 'Hour'), ('day', 'Day of the Week'), ('borough', 'Borough'),
+                        ('cells', 'Location Cell'), ('factor', 'Contributing Factor')]:
+        logging.debug("\nInjuries by %s (aggregated):", title)
+        logging.debug(aggregates[name])
+
+    plot_dashboard(aggregates)
+
+    # Show the plots
+    if not args.headless:
+        plt.show()
 
-# Replace labels in the index of the top_factors DataFrame
-top_factors.index = [label_replacement.get(x, x) for x in top_factors.index]
-
-# Plotting all graphs
-plt.figure(figsize=(18, 12))
-
-# Injuries by Hour
-plt.subplot(2, 2, 1)
-sns.barplot(x=injuries_by_hour.index, y=injuries_by_hour['Cyclists Injured'])
-plt.title('Cyclist Injuries by Hour')
-plt.xlabel('Hour of the Day')
-plt.ylabel('Number of Cyclist Injuries')
-plt.xticks(rotation=45)
-
-# Injuries by Day of the Week
-plt.subplot(2, 2, 2)
-sns.barplot(x=injuries_by_day.index, y=injuries_by_day['Cyclists Injured'])
-plt.title('Cyclist Injuries by Day of the Week')
-plt.xlabel('Day of the Week')
-plt.ylabel('Number of Cyclist Injuries')
-plt.xticks(rotation=25)
-
-# Injuries by Borough
-plt.subplot(2, 2, 3)
-sns.barplot(x=injuries_by_borough.index, y=injuries_by_borough['Cyclists Injured'])
-plt.title('Cyclist Injuries by Borough')
-plt.xlabel('Borough')
-plt.ylabel('Number of Cyclist Injuries')
-plt.xticks(rotation=25)
-
-# Top 5 Injuries by Contributing Factor
-plt.subplot(2, 2, 4)
-ax = sns.barplot(x=top_factors.index, y=top_factors['Cyclists Injured'])
-plt.title('Cyclist Injuries by Contributing Factor')
-plt.xlabel('Contributing Factor')
-plt.ylabel('Number of Cyclist Injuries')
-
-# Align x-axis labels with tick marks
-ax.set_xticks(range(len(top_factors.index)))
-ax.set_xticklabels(top_factors.index, rotation=25, ha='right')
-
-# Adjust layout with padding
-plt.subplots_adjust(left=0.1, right=0.9, top=0.9, bottom=0.22, wspace=0.7, hspace=0.7)  # Add space between plots and margins
-
-# Save the figure
-plt.savefig('cyclist_accidents_analysis.png')
-
-# Show the plots
-plt.show()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import hashlib
+import logging
+import os
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import eigsh
+from scipy.spatial import cKDTree
+
+from profiling import profiled
+
+DEFAULT_CACHE_DIR = 'cache'
+
+
+def graph_key(G, dim, seed, iterations):
+    """
+    Hash the graph structure and layout parameters into a cache key.
+    """
+    digest = hashlib.sha1()
+    digest.update(repr((dim, seed, iterations)).encode())
+    for node in sorted(map(str, G.nodes())):
+        digest.update(node.encode() + b'\0')
+    for u, v in sorted((str(u), str(v)) for u, v in G.edges()):
+        digest.update(u.encode() + b'\1' + v.encode() + b'\0')
+    return digest.hexdigest()[:16]
+
+
+def _adjacency(G, nodes):
+    """
+    Symmetric sparse adjacency matrix of the graph, ignoring edge direction and self-loops.
+    """
+    index = {node: i for i, node in enumerate(nodes)}
+    edges = np.array([(index[u], index[v]) for u, v in G.edges() if u != v], dtype=np.int64).reshape(-1, 2)
+    rows, cols = np.r_[edges[:, 0], edges[:, 1]], np.r_[edges[:, 1], edges[:, 0]]
+    adjacency = sparse.coo_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(nodes), len(nodes))).tocsr()
+    adjacency.data[:] = 1.0
+    return adjacency
+
+
+def spectral_init(adjacency, dim=3, seed=0):
+    """
+    Initial positions from the eigenvectors of the normalized Laplacian with the smallest non-trivial
+    eigenvalues. Falls back to random positions for graphs too small to have enough eigenvectors.
+    """
+    rng = np.random.default_rng(seed)
+    n = adjacency.shape[0]
+    if n <= dim + 2:
+        return rng.uniform(-1, 1, size=(n, dim))
+
+    degree = np.asarray(adjacency.sum(axis=1)).ravel()
+    with np.errstate(divide='ignore'):
+        inv_sqrt = np.where(degree > 0, 1 / np.sqrt(degree), 0.0)
+    normalized = sparse.diags(inv_sqrt) @ adjacency @ sparse.diags(inv_sqrt)
+
+    # The smallest eigenvalues of I - N are the largest of I + N, whose spectrum is non-negative
+    shifted = normalized + sparse.identity(n)
+    _, vectors = eigsh(shifted, k=dim + 1, which='LA', v0=rng.uniform(-1, 1, n))
+    positions = vectors[:, :-1][:, ::-1] * inv_sqrt[:, None]
+
+    # Separate nodes that share a position (isolated nodes, symmetric components)
+    return positions + rng.normal(scale=1e-3 * (np.abs(positions).max() or 1), size=positions.shape)
+
+
+def _accumulate(n, index, values):
+    return np.column_stack([np.bincount(index, weights=values[:, d], minlength=n) for d in range(values.shape[1])])
+
+
+def refine(positions, adjacency, iterations=50, k=None, temperature=None, gravity=0.05):
+    """
+    Fruchterman-Reingold refinement with the repulsion limited to neighbours within 2k, found with a
+    KD-tree, so each iteration costs O(n log n + edges) rather than O(n^2). A weak pull towards the
+    centre keeps disconnected components together.
+    """
+    positions = np.array(positions, dtype=np.float64)
+    n, dim = positions.shape
+    if n < 2 or iterations <= 0:
+        return positions
+
+    k = k or 1.0
+    # Spread the starting positions over a volume that gives every node about k of room
+    extent = np.abs(positions - positions.mean(axis=0)).max() or 1.0
+    positions = (positions - positions.mean(axis=0)) / extent * k * n ** (1 / dim)
+    temperature = temperature or k * n ** (1 / dim) / 10
+    cooling = (0.01 / 1.0) ** (1 / iterations)
+
+    edges = sparse.triu(adjacency, k=1).tocoo()
+    rows, cols = edges.row, edges.col
+    for _ in range(iterations):
+        displacement = -gravity * positions
+
+        # Repulsion between nearby nodes: k^2 / d
+        pairs = cKDTree(positions).query_pairs(2 * k, output_type='ndarray')
+        if len(pairs):
+            delta = positions[pairs[:, 0]] - positions[pairs[:, 1]]
+            distance = np.maximum(np.linalg.norm(delta, axis=1), 1e-9)
+            force = delta * (k * k / distance ** 2)[:, None]
+            displacement += _accumulate(n, pairs[:, 0], force) - _accumulate(n, pairs[:, 1], force)
+
+        # Attraction along edges: d^2 / k
+        if len(rows):
+            delta = positions[rows] - positions[cols]
+            distance = np.maximum(np.linalg.norm(delta, axis=1), 1e-9)
+            force = delta * (distance / k)[:, None]
+            displacement += _accumulate(n, cols, force) - _accumulate(n, rows, force)
+
+        # Move every node by at most the current temperature
+        length = np.maximum(np.linalg.norm(displacement, axis=1), 1e-9)
+        positions += displacement * (np.minimum(length, temperature) / length)[:, None]
+        temperature *= cooling
+
+    return positions
+
+
+def _rescale(positions):
+    centred = positions - positions.mean(axis=0)
+    return centred / (np.abs(centred).max() or 1.0)
+
+
+def _load(path):
+    with np.load(path) as f:
+        return dict(zip(f['nodes'].tolist(), f['positions']))
+
+
+def _save(path, nodes, positions):
+    np.savez(path + '.tmp.npz', nodes=np.asarray([str(node) for node in nodes]), positions=positions)
+    os.replace(path + '.tmp.npz', path)
+
+
+@profiled('layout')
+def layout_graph(G, dim=3, seed=0, iterations=50, warm_iterations=10, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Lay out a graph in dim dimensions, scaled to [-1, 1], and return a dict of node -> position.
+    Layouts are cached on disk keyed by a hash of the graph, seed and parameters. When the exact graph
+    has not been laid out before, the most recent layout is reused as a warm start: known nodes keep their
+    positions, new nodes start at the mean of their placed neighbours, and only warm_iterations refinement
+    steps are run. Otherwise the layout starts from a spectral initialisation.
+    """
+    nodes = list(G.nodes())
+    if not nodes:
+        return {}
+
+    key = graph_key(G, dim, seed, iterations)
+    path = os.path.join(cache_dir, f"layout-{key}.npz")
+    latest_path = os.path.join(cache_dir, f"layout-latest-{dim}d.npz")
+    if os.path.exists(path):
+        logging.info("Reading graph layout from %s.", path)
+        cached = _load(path)
+        return {node: cached[str(node)] for node in nodes}
+
+    adjacency = _adjacency(G, nodes)
+    previous = _load(latest_path) if os.path.exists(latest_path) else {}
+    known = np.array([str(node) in previous for node in nodes])
+
+    if known.sum() >= max(2, len(nodes) // 2):
+        # Warm start from the previous layout
+        positions = np.array([previous[str(node)] if is_known else np.zeros(dim) for node, is_known in zip(nodes, known)])
+        rng = np.random.default_rng(seed)
+        placed = sparse.diags(known.astype(float))
+        neighbour_sum = adjacency @ placed @ positions
+        neighbour_count = np.asarray((adjacency @ placed).sum(axis=1)).ravel()
+        fresh = ~known
+        positions[fresh] = np.where(neighbour_count[fresh, None] > 0,
+                                    neighbour_sum[fresh] / np.maximum(neighbour_count[fresh, None], 1),
+                                    rng.uniform(-1, 1, size=(fresh.sum(), dim)))
+        positions[fresh] += rng.normal(scale=0.05, size=(fresh.sum(), dim))
+        positions = refine(positions, adjacency, warm_iterations, temperature=0.1 * len(nodes) ** (1 / dim))
+        logging.info("Warm-started layout of %d nodes from %d known positions.", len(nodes), known.sum())
+    else:
+        positions = refine(spectral_init(adjacency, dim, seed), adjacency, iterations)
+
+    positions = _rescale(positions)
+    os.makedirs(cache_dir or '.', exist_ok=True)
+    _save(path, nodes, positions)
+    _save(latest_path, nodes, positions)
+    return dict(zip(nodes, positions))
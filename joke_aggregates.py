@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+from profiling import profiled
+
+
+@profiled('group_stats')
+def group_score_stats(codes, scores, groups):
+    """
+    Compute count, sum, mean and sample variance of the scores for every group code in a single pass.
+    Returns a DataFrame indexed by canonical group ID.
+    """
+    # Rows without a jokeid are encoded as -1 and left out
+    valid = codes >= 0
+    codes = codes[valid]
+    scores = np.asarray(scores, dtype=np.float64)[valid]
+    n_groups = len(groups)
+    count = np.bincount(codes, minlength=n_groups)
+    total = np.bincount(codes, weights=scores, minlength=n_groups)
+    total_sq = np.bincount(codes, weights=scores * scores, minlength=n_groups)
+    return score_stats(count, total, total_sq, pd.Index(groups, name='jokeid'))
+
+
+def score_stats(count, total, total_sq, index=None):
+    """
+    Count, sum, mean and sample variance from per-group running totals of the scores, their squares and
+    their count. Returns a DataFrame with the given index.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = total / count
+        var = (total_sq - total * mean) / (count - 1)
+    return pd.DataFrame({'count': count, 'sum': total, 'mean': mean, 'var': var}, index=index)
+
+
+def top_groups(stats, n=20, by='mean', min_count=1):
+    """
+    Return the IDs of the n groups with the highest value of the given statistic.
+    Ties are broken by group ID so the selection is stable between runs.
+    """
+    eligible = stats[stats['count'] >= min_count]
+    order = np.lexsort((eligible.index.to_numpy(dtype=str), -eligible[by].to_numpy()))
+    return list(eligible.index[order[:n]])
@@ -0,0 +1,170 @@
+import json
+import logging
+import os
+import tempfile
+
+import numpy as np
+from rapidfuzz import fuzz, process
+from rapidfuzz.utils import default_process
+
+from profiling import log_every, profiled
+
+
+def _sort_key(jokeid, token_sort):
+    # Keys are compared case-insensitively, with punctuation as whitespace (rapidfuzz's default_process);
+    # token_sort_ratio is plain ratio over whitespace tokens sorted and re-joined
+    key = default_process(jokeid)
+    if token_sort:
+        return " ".join(sorted(key.split()))
+    return key
+
+
+def _find(parent, i):
+    # Union-find lookup with path halving
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def _link(keys, threshold, block_size, workers):
+    """
+    Union-find roots of keys sorted by length, joining every pair whose ratio is at least threshold.
+    """
+    lengths = np.array([len(key) for key in keys])
+    max_ratio = (200.0 - threshold) / threshold if threshold > 0 else np.inf
+
+    parent = list(range(len(keys)))
+    for start in range(0, len(keys), block_size):
+        stop = min(start + block_size, len(keys))
+        band_end = int(np.searchsorted(lengths, max(lengths[stop - 1], 1) * max_ratio, side='right'))
+        band_end = max(band_end, stop)
+
+        scores = process.cdist(keys[start:stop], keys[start:band_end], scorer=fuzz.ratio, processor=None,
+                               score_cutoff=threshold, dtype=np.uint8, workers=workers)
+        rows, cols = np.nonzero(scores >= threshold)
+        for i, j in zip(rows + start, cols + start):
+            if i < j:
+                root_i, root_j = _find(parent, i), _find(parent, j)
+                if root_i != root_j:
+                    parent[max(root_i, root_j)] = min(root_i, root_j)
+        log_every(16, start // block_size, logging.DEBUG, "Compared %d of %d joke IDs.", stop, len(keys))
+    return [_find(parent, i) for i in range(len(keys))]
+
+
+def _canonical(ids, members):
+    # The shortest member, ties broken alphabetically
+    return min(members, key=lambda i: (len(ids[i]), ids[i]))
+
+
+@profiled('clustering')
+def cluster_jokeids(jokeids, threshold=70, token_sort=True, block_size=1024, workers=-1):
+    """
+    Cluster joke IDs whose fuzzy similarity is greater than or equal to the threshold.
+    Similarity is rapidfuzz's ratio (or token_sort_ratio when token_sort is set) of the IDs lowercased
+    with punctuation as whitespace, computed in batched cdist blocks on all cores. Matches are joined
+    transitively with union-find, and every cluster is labelled by its shortest member (ties broken
+    alphabetically), so the result does not depend on the order of the input.
+    Transitive matching alone chains IDs (a ~ b ~ c ~ ...) into clusters whose ends have nothing in
+    common, so every member must also score at least the threshold against its cluster's canonical ID;
+    the members that do not are split off and clustered again among themselves.
+    Returns a dict mapping each joke ID to its canonical group ID.
+    """
+    ids = sorted({jokeid for jokeid in jokeids if isinstance(jokeid, str)})
+    keys = [_sort_key(jokeid, token_sort) for jokeid in ids]
+
+    # Sort by key length: ratio <= 200 * min(len) / (len_a + len_b), so each block only
+    # has to be compared against the band of keys that are short enough to still match
+    order = sorted(range(len(ids)), key=lambda i: (len(keys[i]), keys[i]))
+    ids = [ids[i] for i in order]
+    keys = [keys[i] for i in order]
+
+    clusters = {}
+    for i, root in enumerate(_link(keys, threshold, block_size, workers)):
+        clusters.setdefault(root, []).append(i)
+
+    aliases = {}
+    pending = list(clusters.values())
+    while pending:
+        members = pending.pop()
+        canonical = _canonical(ids, members)
+        if len(members) > 2:
+            scores = process.cdist([keys[canonical]], [keys[i] for i in members], scorer=fuzz.ratio, processor=None,
+                                   score_cutoff=threshold, dtype=np.uint8, workers=workers)[0]
+            rest = [i for i, score in zip(members, scores) if score < threshold]
+            if rest:
+                # Re-link the split-off members among themselves, in their length order
+                split = {}
+                for i, root in zip(rest, _link([keys[i] for i in rest], threshold, block_size, workers)):
+                    split.setdefault(root, []).append(i)
+                pending.extend(split.values())
+                members = [i for i, score in zip(members, scores) if score >= threshold]
+        aliases.update({ids[i]: ids[canonical] for i in members})
+    return aliases
+
+
+def load_alias_table(path):
+    """
+    Load a persisted alias table. Returns (aliases, params), or ({}, None) if the file does not exist.
+    """
+    if not os.path.exists(path):
+        return {}, None
+    with open(path) as f:
+        table = json.load(f)
+    return table['aliases'], table['params']
+
+
+def save_alias_table(aliases, params, path):
+    """
+    Write the alias table atomically so an interrupted run never leaves a truncated file behind.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'params': params, 'aliases': aliases}, f, indent=0, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+@profiled('alias_table')
+def update_alias_table(jokeids, path, threshold=80, token_sort=False, recluster=False):
+    """
+    Return a jokeid -> canonical group mapping covering every ID in jokeids, backed by a persisted alias table.
+    Only IDs that have never been seen are matched, against the existing canonical set; IDs that match nothing
+    are clustered among themselves and become new groups. A full re-cluster only happens when requested,
+    or when the stored table was built with different matching parameters.
+    """
+    params = {'threshold': threshold, 'token_sort': token_sort, 'processor': 'default_process', 'linkage': 'canonical'}
+    aliases, stored_params = load_alias_table(path)
+    distinct = {jokeid for jokeid in jokeids if isinstance(jokeid, str)}
+
+    if recluster or stored_params != params:
+        logging.info("Re-clustering %d joke IDs from scratch...", len(distinct | aliases.keys()))
+        aliases = cluster_jokeids(distinct | aliases.keys(), threshold=threshold, token_sort=token_sort)
+        save_alias_table(aliases, params, path)
+        return aliases
+
+    new_ids = sorted(distinct - aliases.keys())
+    if not new_ids:
+        return aliases
+
+    # Match the new IDs against the existing canonical IDs in one batch
+    canonical_ids = sorted(set(aliases.values()))
+    unmatched = new_ids
+    if canonical_ids:
+        new_keys = [_sort_key(jokeid, token_sort) for jokeid in new_ids]
+        canonical_keys = [_sort_key(jokeid, token_sort) for jokeid in canonical_ids]
+        scores = process.cdist(new_keys, canonical_keys, scorer=fuzz.ratio, processor=None,
+                               score_cutoff=threshold, dtype=np.uint8, workers=-1)
+        best = scores.argmax(axis=1)
+        matched = scores[np.arange(len(new_ids)), best] >= threshold
+        for jokeid, is_matched, idx in zip(new_ids, matched, best):
+            if is_matched:
+                aliases[jokeid] = canonical_ids[idx]
+        unmatched = [jokeid for jokeid, is_matched in zip(new_ids, matched) if not is_matched]
+
+    # Whatever is left forms new groups of its own
+    aliases.update(cluster_jokeids(unmatched, threshold=threshold, token_sort=token_sort))
+    logging.info("Added %d new joke IDs to the alias table (%d new groups).",
+                 len(new_ids), len(set(aliases.values())) - len(canonical_ids))
+    save_alias_table(aliases, params, path)
+    return aliases
@@ -0,0 +1,110 @@
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from joke_cooccurrence import encode_sets
+from joke_data import data_version
+from joke_encoding import alias_digest, vocabulary_groups
+from joke_intervals import share_intervals
+from profiling import profiled
+
+DEFAULT_CACHE_DIR = 'cache'
+
+
+@profiled('companions')
+def companion_frequencies(jokes, jokeid_to_group, jokeids=None):
+    """
+    For every jokeid (or only the given ones), count how often each other joke group was performed
+    in the sets (date + venue) where that jokeid scored above its own average score.
+    Works as sparse products: (jokeid x set) high-score counts @ (set x jokeid) row counts, with the
+    jokeid itself removed, then folded into canonical groups.
+    Also counts the high-scoring sets of every jokeid (high_sets) and how many of them had the companion
+    (sets), with a Jeffreys interval of that share (share_low, share_high) to rank companions by.
+    Returns a frame with jokeid and companion categoricals and count, sets, high_sets, share_low and
+    share_high columns, sorted by jokeid and descending count.
+    """
+    vocabulary = np.asarray(jokes['jokeid'].cat.categories, dtype=object)
+    codes = jokes['jokeid'].cat.codes.to_numpy()
+    scores = jokes['score'].to_numpy(dtype=float, na_value=np.nan)
+    n_jokes = len(vocabulary)
+
+    # Average score of every jokeid over all of its scored performances
+    scored = (codes >= 0) & ~np.isnan(scores)
+    totals = np.bincount(codes[scored], weights=scores[scored], minlength=n_jokes)
+    counts = np.bincount(codes[scored], minlength=n_jokes)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = totals / counts
+
+    # Only rows with a jokeid, date and venue can share a set
+    in_set = (codes >= 0) & jokes['date'].notna().to_numpy() & jokes['venue'].notna().to_numpy()
+    set_codes = encode_sets(jokes['date'][in_set], jokes['venue'][in_set])
+    codes, scores = codes[in_set], scores[in_set]
+    n_sets = int(set_codes.max()) + 1 if len(set_codes) else 0
+
+    high = scores > means[codes]
+    if jokeids is not None:
+        high &= np.isin(codes, pd.Index(vocabulary).get_indexer(jokeids))
+    high_sets = sparse.csr_matrix((np.ones(high.sum()), (codes[high], set_codes[high])), shape=(n_jokes, n_sets))
+    set_members = sparse.csr_matrix((np.ones(len(codes)), (set_codes, codes)), shape=(n_sets, n_jokes))
+
+    companions = (high_sets @ set_members).tolil()
+    companions.setdiag(0)
+
+    # Fold companion jokeids into their canonical groups
+    group_codes, groups = vocabulary_groups(vocabulary, jokeid_to_group)
+    to_group = sparse.csr_matrix((np.ones(n_jokes), (np.arange(n_jokes), group_codes)), shape=(n_jokes, len(groups)))
+    grouped = (companions.tocsr() @ to_group).tocoo()
+    keep = grouped.data > 0
+    rows, cols = grouped.row[keep], grouped.col[keep]
+
+    # Number of distinct high-scoring sets with each companion group: (jokeid x set) 0/1 @ (set x group) 0/1.
+    # For the jokeid's own group only the sets with another of its jokeids count.
+    high_sets.data[:] = 1
+    set_groups = (set_members @ to_group).tocsr()
+    in_sets = (high_sets @ (set_groups > 0).astype(np.float64)).tocsr()
+    high = high_sets.tocoo()
+    others = np.asarray(set_groups[high.col, group_codes[high.row]]).ravel() > np.asarray(set_members[high.col, high.row]).ravel()
+    own = np.bincount(high.row, weights=others, minlength=n_jokes)
+    sets = np.where(cols == group_codes[rows], own[rows], np.asarray(in_sets[rows, cols]).ravel())
+    n_high = np.diff(high_sets.indptr)[rows]
+    share_low, share_high = share_intervals(sets, n_high)
+
+    result = pd.DataFrame({
+        'jokeid': pd.Categorical.from_codes(rows, vocabulary),
+        'companion': pd.Categorical.from_codes(cols, groups),
+        'count': grouped.data[keep].astype(np.int32),
+        'sets': sets.astype(np.int32),
+        'high_sets': n_high.astype(np.int32),
+        'share_low': share_low,
+        'share_high': share_high,
+    })
+    return result.sort_values(['jokeid', 'count', 'companion'], ascending=[True, False, True], ignore_index=True)
+
+
+def companions_path(jokes, jokeid_to_group, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Path of the batch companion table for this version of the jokes table and alias mapping.
+    """
+    return os.path.join(cache_dir, f"companions-{data_version(jokes)}-{alias_digest(jokeid_to_group)}.parquet")
+
+
+def save_companions(companions, path):
+    """
+    Save the batch companion table as Parquet, in row groups so single jokeid reads skip most of the file.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    companions.to_parquet(path + '.tmp', index=False, row_group_size=10000)
+    os.replace(path + '.tmp', path)
+    logging.info("Saved %d companion counts to %s.", len(companions), path)
+
+
+def read_companions(path, jokeid):
+    """
+    Read the companion counts of one jokeid from a saved batch companion table.
+    """
+    return pd.read_parquet(path, filters=[('jokeid', '==', jokeid)]).reset_index(drop=True)
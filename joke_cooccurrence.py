@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from profiling import profiled
+
+
+def encode_sets(dates, venues):
+    """
+    Integer-encode (date, venue) sets. A missing venue is still a set of its own, as in the old dict keys.
+    """
+    sets = pd.DataFrame({'date': dates, 'venue': venues})
+    return sets.groupby(['date', 'venue'], dropna=False, sort=False).ngroup().to_numpy(dtype=np.int32)
+
+
+def _set_pairs(set_codes):
+    """
+    Return (left, right) row indices of every unordered pair of rows that share a set.
+    """
+    order = np.argsort(set_codes, kind='stable')
+    sorted_sets = set_codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_sets[1:] != sorted_sets[:-1]])
+    sizes = np.diff(np.r_[starts, len(sorted_sets)])
+
+    # Every row pairs with the rows after it in the same set
+    set_end = np.repeat(starts + sizes, sizes)
+    n_partners = set_end - np.arange(len(sorted_sets)) - 1
+    left = np.repeat(np.arange(len(sorted_sets)), n_partners)
+    run_starts = np.repeat(np.cumsum(n_partners) - n_partners, n_partners)
+    right = left + 1 + np.arange(len(left)) - run_starts
+    return order[left], order[right]
+
+
+@profiled('cooccurrence')
+def build_cooccurrence(set_codes, codes, scores, n_groups):
+    """
+    Build symmetric sparse matrices of summed pair scores and pair counts for every pair of groups
+    that appear in the same set. The pair score is the average of the two performances' scores.
+    Pairs of the same group are left out, so the diagonal stays empty.
+    """
+    set_codes = np.asarray(set_codes)
+    codes = np.asarray(codes)
+    scores = np.asarray(scores, dtype=np.float64)
+
+    left, right = _set_pairs(set_codes)
+    a, b = codes[left], codes[right]
+    keep = (a != b) & (a >= 0) & (b >= 0)
+    a, b = a[keep], b[keep]
+    pair_scores = (scores[left[keep]] + scores[right[keep]]) / 2
+
+    # COO duplicates are summed on conversion, which accumulates every occurrence of a pair
+    rows, cols = np.r_[a, b], np.r_[b, a]
+    shape = (n_groups, n_groups)
+    sums = sparse.coo_matrix((np.r_[pair_scores, pair_scores], (rows, cols)), shape=shape).tocsr()
+    counts = sparse.coo_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=shape).tocsr()
+    return sums, counts
+
+
+def save_cooccurrence(path, sums, counts, groups, group_stats=None):
+    """
+    Save the co-occurrence matrices, the group labels and optionally per-group count/mean to one .npz file.
+    """
+    arrays = {
+        'sums_data': sums.data, 'sums_indices': sums.indices, 'sums_indptr': sums.indptr,
+        'counts_data': counts.data, 'counts_indices': counts.indices, 'counts_indptr': counts.indptr,
+        'groups': np.asarray(groups, dtype=str),
+    }
+    if group_stats is not None:
+        arrays['group_count'] = group_stats['count'].to_numpy()
+        arrays['group_mean'] = group_stats['mean'].to_numpy()
+    np.savez(path, **arrays)
+
+
+def load_cooccurrence(path):
+    """
+    Load matrices saved by save_cooccurrence. Returns (sums, counts, groups, group_stats or None).
+    """
+    with np.load(path) as f:
+        groups = f['groups'].astype(object)
+        shape = (len(groups), len(groups))
+        sums = sparse.csr_matrix((f['sums_data'], f['sums_indices'], f['sums_indptr']), shape=shape)
+        counts = sparse.csr_matrix((f['counts_data'], f['counts_indices'], f['counts_indptr']), shape=shape)
+        group_stats = None
+        if 'group_count' in f:
+            group_stats = pd.DataFrame({'count': f['group_count'], 'mean': f['group_mean']},
+                                       index=pd.Index(groups, name='jokeid'))
+    return sums, counts, groups, group_stats
+
+
+def dense_block(sums, counts, groups, subset):
+    """
+    Slice the average pair score for the given subset of group IDs as a dense matrix.
+    Pairs that never shared a set are 0.
+    """
+    index = pd.Index(groups).get_indexer(subset)
+    if (index < 0).any():
+        missing = [jokeid for jokeid, idx in zip(subset, index) if idx < 0]
+        raise KeyError(f"Unknown jokeid groups: {missing}")
+
+    block_sums = sums[index][:, index].toarray()
+    block_counts = counts[index][:, index].toarray()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(block_counts > 0, block_sums / block_counts, 0.0)
@@ -0,0 +1,424 @@
+import hashlib
+import logging
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from profiling import profiled
+
+# Columns the analyses use, in the order they are returned
+JOKE_COLUMNS = ['id', 'jokeid', 'date', 'score', 'venue', 'time']
+
+# Resolution of the date column whatever the source, so data_version and the caches keyed by it agree
+DATE_DTYPE = 'datetime64[us]'
+
+DEFAULT_DUMP_PATH = 'joke_table.sql'
+DEFAULT_CACHE_PATH = os.path.join('cache', 'jokes.parquet')
+DEFAULT_QUERY_CACHE_DIR = os.path.join('cache', 'queries')
+
+# Rows fetched per round trip when streaming a query result
+DEFAULT_BATCH_SIZE = 50_000
+
+# Connection settings, overridden by the MYSQL_* environment variables and then by the command line
+DEFAULT_CREDENTIALS = {'host': 'localhost', 'user': 'root', 'password': '', 'database': 'jokes'}
+_CREDENTIAL_ENVIRONMENT = {'host': 'MYSQL_HOST', 'user': 'MYSQL_USER', 'password': 'MYSQL_PWD', 'database': 'MYSQL_DATABASE'}
+
+# One connection pool per set of credentials, shared by every query of the process
+_pools = {}
+
+_CREATE_TABLE = re.compile(r"CREATE TABLE `(\w+)`")
+_COLUMN_DEF = re.compile(r"\s*`(\w+)`")
+_INSERT = re.compile(r"INSERT INTO `(\w+)` VALUES ")
+_VALUE = re.compile(r"'((?:[^'\\]|\\.)*)'|(NULL)|([^,()']+)")
+_ESCAPE = re.compile(r"\\(.)")
+_ESCAPES = {'0': '\0', 'n': '\n', 'r': '\r', 't': '\t', 'Z': '\x1a', 'b': '\b'}
+
+
+def _unescape(value):
+    if '\\' not in value:
+        return value
+    return _ESCAPE.sub(lambda m: _ESCAPES.get(m.group(1), m.group(1)), value)
+
+
+def _parse_values(statement, n_columns):
+    """
+    Parse the tuples of one extended INSERT statement into a list per column.
+    """
+    columns = [[] for _ in range(n_columns)]
+    position = 0
+    i = 0
+    for match in _VALUE.finditer(statement):
+        quoted, null, bare = match.groups()
+        if quoted is not None:
+            value = _unescape(quoted)
+        elif null is not None:
+            value = None
+        else:
+            value = bare.strip()
+        columns[i].append(value)
+        i = (i + 1) % n_columns
+        position = match.end()
+    if i != 0:
+        raise ValueError(f"Truncated INSERT statement near offset {position}")
+    return columns
+
+
+def typed_frame(columns):
+    """
+    Build the typed, columnar jokes frame from raw column values (strings, numbers or None).
+    jokeid and venue are dictionary-encoded, date is datetime64 and score/time are nullable ints.
+    """
+    frame = pd.DataFrame({
+        'id': pd.to_numeric(pd.Series(columns['id'], dtype=object)).astype(np.int32),
+        'jokeid': pd.Categorical(columns['jokeid']),
+        'date': pd.to_datetime(pd.Series(columns['date'], dtype=object), format='%Y-%m-%d', errors='coerce').astype(DATE_DTYPE),
+        'score': pd.to_numeric(pd.Series(columns['score'], dtype=object)).astype('Int16'),
+        'venue': pd.Categorical(columns['venue']),
+        'time': pd.to_numeric(pd.Series(columns['time'], dtype=object)).astype('Int32'),
+    })
+    return frame.sort_values('id', ignore_index=True)
+
+
+def read_dump(path=DEFAULT_DUMP_PATH, table='jokes'):
+    """
+    Stream a mysqldump file and parse the INSERT statements for the given table into a typed jokes frame.
+    The file is read line by line, so only one extended INSERT statement is held in memory at a time.
+    """
+    table_columns = None
+    batches = []
+    with open(path, encoding='utf-8') as f:
+        in_create = False
+        for line in f:
+            if in_create:
+                column = _COLUMN_DEF.match(line)
+                if column:
+                    table_columns.append(column.group(1))
+                else:
+                    in_create = False
+                continue
+
+            create = _CREATE_TABLE.match(line)
+            if create and create.group(1) == table:
+                table_columns = []
+                in_create = True
+                continue
+
+            insert = _INSERT.match(line)
+            if insert and insert.group(1) == table:
+                if table_columns is None:
+                    raise ValueError(f"INSERT for `{table}` found before its CREATE TABLE in {path}")
+                values = _parse_values(line[insert.end():].rstrip().rstrip(';'), len(table_columns))
+                batch = dict(zip(table_columns, values))
+                batches.append(typed_frame({column: batch[column] for column in JOKE_COLUMNS}))
+
+    if table_columns is None:
+        raise ValueError(f"No table `{table}` in {path}")
+    if not batches:
+        return typed_frame({column: [] for column in JOKE_COLUMNS})
+
+    # Re-encode the categoricals over the union of every batch's dictionary
+    frame = pd.concat(batches, ignore_index=True)
+    for column in ('jokeid', 'venue'):
+        frame[column] = frame[column].astype(object).astype('category')
+    logging.info("Parsed %d rows of `%s` from %s.", len(frame), table, path)
+    return frame.sort_values('id', ignore_index=True)
+
+
+def resolve_credentials(**overrides):
+    """
+    Return the MySQL connection settings: the given overrides that are not None, then the MYSQL_HOST,
+    MYSQL_USER, MYSQL_PWD and MYSQL_DATABASE environment variables, then the defaults.
+    """
+    credentials = {key: os.environ.get(variable, DEFAULT_CREDENTIALS[key]) for key, variable in _CREDENTIAL_ENVIRONMENT.items()}
+    credentials.update({key: value for key, value in overrides.items() if value is not None})
+    return credentials
+
+
+def get_connection(credentials=None, pool_size=4):
+    """
+    Take a connection from the pool for these credentials, creating the pool on first use.
+    Closing the connection returns it to the pool.
+    """
+    from mysql.connector import pooling
+
+    credentials = credentials or resolve_credentials()
+    key = tuple(sorted(credentials.items()))
+    if key not in _pools:
+        _pools[key] = pooling.MySQLConnectionPool(pool_name=f"jokes{len(_pools)}", pool_size=pool_size, **credentials)
+    return _pools[key].get_connection()
+
+
+def normalize_query(sql):
+    """
+    Collapse whitespace and drop the trailing semicolon, so formatting changes do not change the cache key.
+    """
+    return ' '.join(sql.split()).rstrip(';').rstrip()
+
+
+def table_version(connection, table='jokes'):
+    """
+    Cheap version of an append-only table: its (MAX(id), COUNT(*)).
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute(f"SELECT MAX(id), COUNT(*) FROM `{table}`")
+        max_id, count = cursor.fetchone()
+    finally:
+        cursor.close()
+    return int(max_id or 0), int(count)
+
+
+def _fetch_columns(connection, sql, params=()):
+    """
+    Run a query and return its result as a dict of column name -> values.
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute(sql, tuple(params))
+        names = [description[0] for description in cursor.description]
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    logging.info("Retrieved %d rows from the database.", len(rows))
+    values = list(zip(*rows)) if rows else [[] for _ in names]
+    return dict(zip(names, values))
+
+
+def iter_batches(connection, sql, params=(), batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Run a query on an unbuffered cursor and yield (column names, rows) in fetchmany batches of at most
+    batch_size rows. Rows are read off the connection as the batches are consumed, so only one batch of
+    row tuples is alive at a time. A consumer that stops early still drains the rest of the result, which
+    the connection needs before it can run another query.
+    """
+    cursor = connection.cursor(buffered=False)
+    exhausted = False
+    try:
+        cursor.execute(sql, tuple(params))
+        names = [description[0] for description in cursor.description]
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                exhausted = True
+                break
+            yield names, rows
+    finally:
+        if not exhausted:
+            while cursor.fetchmany(batch_size):
+                pass
+        cursor.close()
+
+
+def _intern_values(vocabulary, values):
+    """
+    int32 codes of values in a growing value -> code dict, adding the values it does not have yet.
+    Missing values are -1. The dict is only consulted once per distinct value of the batch.
+    """
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    lookup = np.array([vocabulary.setdefault(value, len(vocabulary)) for value in uniques], dtype=np.int32)
+    return np.where(codes >= 0, lookup[codes] if len(lookup) else -1, -1).astype(np.int32)
+
+
+def encode_joke_rows(names, rows, vocabularies):
+    """
+    Convert one batch of fetched jokes rows straight into typed arrays: int32 id, datetime64[D] date (NaT
+    for NULL), float64 score and time (NaN for NULL), and int32 jokeid and venue codes into the given
+    vocabularies ({'jokeid': {}, 'venue': {}}), which keep growing across batches.
+    """
+    columns = dict(zip(names, zip(*rows))) if rows else {name: () for name in names}
+    return {
+        'id': np.array(columns['id'], dtype=np.int32),
+        'jokeid': _intern_values(vocabularies['jokeid'], columns['jokeid']),
+        'date': np.array(columns['date'], dtype='datetime64[D]'),
+        'score': np.array(columns['score'], dtype=np.float64),
+        'venue': _intern_values(vocabularies['venue'], columns['venue']),
+        'time': np.array(columns['time'], dtype=np.float64),
+    }
+
+
+def _categorical(codes, vocabulary, sort=False):
+    categories = np.array(list(vocabulary), dtype=object)
+    if not sort:
+        return pd.Categorical.from_codes(codes, categories)
+    order = np.argsort(categories)
+    recode = np.empty(len(order), dtype=np.int32)
+    recode[order] = np.arange(len(order), dtype=np.int32)
+    return pd.Categorical.from_codes(np.where(codes >= 0, recode[codes] if len(recode) else -1, -1), categories[order])
+
+
+def _arrays_frame(arrays, vocabularies, sort=False):
+    """
+    Build a typed jokes frame from encoded arrays. With sort the categories are sorted and the rows
+    ordered by id, exactly as typed_frame builds them.
+    """
+    frame = pd.DataFrame({
+        'id': arrays['id'],
+        'jokeid': _categorical(arrays['jokeid'], vocabularies['jokeid'], sort),
+        'date': arrays['date'].astype(DATE_DTYPE),
+        'score': pd.array(arrays['score']).astype('Int16'),
+        'venue': _categorical(arrays['venue'], vocabularies['venue'], sort),
+        'time': pd.array(arrays['time']).astype('Int32'),
+    })
+    return frame.sort_values('id', ignore_index=True) if sort else frame
+
+
+def stream_jokes(connection, sql, params=(), batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Yield a query over the jokes columns as typed jokes frames of at most batch_size rows, for aggregations
+    that fold in one batch at a time. The jokeid and venue categoricals of later batches extend the
+    categories of earlier ones, so codes stay comparable across batches.
+    """
+    vocabularies = {'jokeid': {}, 'venue': {}}
+    for names, rows in iter_batches(connection, sql, params, batch_size):
+        yield _arrays_frame(encode_joke_rows(names, rows, vocabularies), vocabularies)
+
+
+def fetch_jokes(connection, sql, params=(), batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Fetch a query over the jokes columns into a typed jokes frame sorted by id. Every batch is encoded into
+    typed arrays as it arrives, so the whole result never exists as Python row tuples.
+    """
+    vocabularies = {'jokeid': {}, 'venue': {}}
+    chunks = [encode_joke_rows(names, rows, vocabularies) for names, rows in iter_batches(connection, sql, params, batch_size)]
+    if not chunks:
+        chunks = [encode_joke_rows(JOKE_COLUMNS, [], vocabularies)]
+    arrays = {name: np.concatenate([chunk[name] for chunk in chunks]) for name in JOKE_COLUMNS}
+    logging.info("Retrieved %d rows from the database in %d batches.", len(arrays['id']), len(chunks))
+    return _arrays_frame(arrays, vocabularies, sort=True)
+
+
+def _fetch_frame(connection, sql, params=()):
+    return pd.DataFrame(_fetch_columns(connection, sql, params))
+
+
+def _query_paths(sql, params, table, credentials, version, cache_dir):
+    query_digest = hashlib.sha1(repr((normalize_query(sql), tuple(params), table, credentials['host'],
+                                      credentials['database'])).encode()).hexdigest()[:16]
+    version_digest = hashlib.sha1(repr(version).encode()).hexdigest()[:8]
+    return os.path.join(cache_dir, f"query-{query_digest}-{version_digest}.parquet"), f"query-{query_digest}-"
+
+
+def cached_query(sql, params=(), table='jokes', credentials=None, fetch=None, cache_dir=DEFAULT_QUERY_CACHE_DIR, refresh=False):
+    """
+    Run a query on a pooled connection and cache its result as Parquet, keyed by the normalized query
+    text, its parameters and the version of the table it reads. While the table has not changed, the result
+    is read back from disk instead of being fetched and deserialized again. fetch(connection, sql, params)
+    runs the query and returns the frame to cache; a plain DataFrame of the fetched columns by default.
+    The version only sees appended and deleted rows, so pass refresh after updating rows in place.
+    """
+    credentials = credentials or resolve_credentials()
+    connection = get_connection(credentials)
+    try:
+        version = table_version(connection, table)
+        path, prefix = _query_paths(sql, params, table, credentials, version, cache_dir)
+        if not refresh and os.path.exists(path):
+            logging.info("Reading query result for `%s` version %s from %s.", table, version, path)
+            return pd.read_parquet(path)
+
+        frame = (fetch or _fetch_frame)(connection, sql, params)
+    finally:
+        connection.close()
+
+    # Replace the results of older versions of the same query
+    os.makedirs(cache_dir, exist_ok=True)
+    frame.to_parquet(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+    for name in os.listdir(cache_dir):
+        if name.startswith(prefix) and name.endswith('.parquet') and os.path.join(cache_dir, name) != path:
+            os.remove(os.path.join(cache_dir, name))
+    return frame
+
+
+def read_mysql(credentials=None, cache_dir=DEFAULT_QUERY_CACHE_DIR, refresh=False):
+    """
+    Fetch the jokes table from a MySQL server into a typed jokes frame, served from the query cache
+    while the table is unchanged. The rows are streamed in batches into typed arrays.
+    """
+    return cached_query(f"SELECT {', '.join(JOKE_COLUMNS)} FROM jokes", table='jokes', credentials=credentials,
+                        fetch=fetch_jokes, cache_dir=cache_dir, refresh=refresh)
+
+
+def stream_new_jokes(after_id, credentials=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Stream only the rows of the jokes table with an id above after_id, in id order, as typed jokes frames
+    of at most batch_size rows, bypassing the query cache.
+    """
+    connection = get_connection(credentials or resolve_credentials())
+    try:
+        yield from stream_jokes(connection, f"SELECT {', '.join(JOKE_COLUMNS)} FROM jokes WHERE id > %s ORDER BY id",
+                                (int(after_id),), batch_size)
+    finally:
+        connection.close()
+
+
+def write_cache(frame, cache_path=DEFAULT_CACHE_PATH):
+    """
+    Write the typed jokes frame to a Parquet cache. Categoricals stay dictionary-encoded on disk.
+    """
+    directory = os.path.dirname(cache_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = cache_path + '.tmp'
+    frame.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, cache_path)
+
+
+@profiled('query')
+def load_jokes(source='mysql', credentials=None, dump_path=DEFAULT_DUMP_PATH, cache_path=DEFAULT_CACHE_PATH,
+               query_cache_dir=DEFAULT_QUERY_CACHE_DIR, refresh=False):
+    """
+    Load the jokes table as a typed, columnar frame sorted by id.
+    source is 'mysql' (live server, through the query cache), 'dump' (parse the mysqldump file and refresh
+    the cache) or 'cache' (read the Parquet cache, building it from the dump the first time).
+    """
+    if source == 'mysql':
+        return read_mysql(credentials, query_cache_dir, refresh)
+    if source == 'cache' and os.path.exists(cache_path):
+        logging.info("Reading jokes from cache %s.", cache_path)
+        return pd.read_parquet(cache_path)
+    if source not in ('dump', 'cache'):
+        raise ValueError(f"Unknown source '{source}'")
+
+    frame = read_dump(dump_path)
+    write_cache(frame, cache_path)
+    return frame
+
+
+def data_version(jokes):
+    """
+    Return a short content hash of the jokes frame, used to key caches derived from this version of the data.
+    """
+    digest = hashlib.sha1(pd.util.hash_pandas_object(jokes, index=False).to_numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+def add_source_arguments(parser):
+    """
+    Add the data source and MySQL connection options shared by the joke scripts.
+    """
+    parser.add_argument('--source', choices=['mysql', 'dump', 'cache'], default='mysql',
+                        help='Where to read the jokes table from: a live MySQL server, the mysqldump file, or the Parquet cache built from it.')
+    parser.add_argument('--dump', default=DEFAULT_DUMP_PATH, help='Path of the mysqldump file used by --source dump/cache.')
+    parser.add_argument('--cache', default=DEFAULT_CACHE_PATH, help='Path of the Parquet cache used by --source dump/cache.')
+    parser.add_argument('--host', help='MySQL host (default: $MYSQL_HOST or localhost).')
+    parser.add_argument('--user', help='MySQL user (default: $MYSQL_USER or root).')
+    parser.add_argument('--password', '--db_password', dest='password', help='MySQL password (default: $MYSQL_PWD or empty).')
+    parser.add_argument('--database', help='MySQL database (default: $MYSQL_DATABASE or jokes).')
+    parser.add_argument('--refresh', action='store_true', help='Re-run the MySQL query even when the table version is unchanged.')
+
+
+def credentials_from_args(args):
+    """
+    Resolve the MySQL connection settings from the options parsed by add_source_arguments.
+    """
+    return resolve_credentials(host=args.host, user=args.user, password=args.password, database=args.database)
+
+
+def load_jokes_from_args(args):
+    """
+    Load the jokes table from the source and connection options parsed by add_source_arguments.
+    """
+    query_cache_dir = os.path.join(os.path.dirname(args.cache), 'queries')
+    return load_jokes(args.source, credentials_from_args(args), args.dump, args.cache, query_cache_dir, args.refresh)
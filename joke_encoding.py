@@ -0,0 +1,66 @@
+import hashlib
+import json
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+
+def as_categorical(values):
+    """
+    Intern values into a categorical: a sorted vocabulary of the distinct values plus int codes, with -1
+    for missing values. Categoricals are returned as they are.
+    """
+    if isinstance(values, pd.Series):
+        values = values.array
+    if isinstance(values, pd.Categorical):
+        return values
+    return pd.Categorical(np.asarray(values, dtype=object))
+
+
+def vocabulary_groups(vocabulary, jokeid_to_group):
+    """
+    Canonical group of every entry of a jokeid vocabulary, looked up once per distinct jokeid.
+    Returns (codes, groups) where groups is sorted and groups[codes[i]] is the group of vocabulary[i].
+    """
+    canonical = pd.Series([jokeid_to_group.get(jokeid, jokeid) for jokeid in vocabulary], dtype=object)
+    codes, groups = pd.factorize(canonical, sort=True)
+    return codes.astype(np.int32), np.asarray(groups, dtype=object)
+
+
+def encode_groups(jokeids, jokeid_to_group):
+    """
+    Integer-encode jokeids by their canonical group. The jokeids are interned first (categoricals already
+    are), so the group mapping is applied to the vocabulary only and rows are recoded with one take.
+    Returns (codes, groups) where groups[codes[i]] is the canonical group of jokeids[i]; groups is sorted
+    and only holds the groups that occur. Rows without a jokeid are -1.
+    """
+    categorical = as_categorical(jokeids)
+    to_group, groups = vocabulary_groups(categorical.categories, jokeid_to_group)
+    codes = np.asarray(categorical.codes)
+    codes = np.where(codes >= 0, to_group[codes], -1)
+
+    # Keep only the groups of the jokeids that occur, in the same sorted order
+    used = np.unique(codes[codes >= 0])
+    recode = np.full(len(groups), -1, dtype=np.int32)
+    recode[used] = np.arange(len(used), dtype=np.int32)
+    return np.where(codes >= 0, recode[codes], -1).astype(np.int32), groups[used]
+
+
+def group_categoricals(columns, jokeid_to_group):
+    """
+    Map several jokeid columns to their canonical groups as categoricals sharing one group vocabulary,
+    so codes compare and group across columns. Strings are only touched once per distinct jokeid.
+    """
+    columns = [as_categorical(column) for column in columns]
+    combined = union_categoricals(columns, ignore_order=True)
+    codes, groups = encode_groups(combined, jokeid_to_group)
+    bounds = np.cumsum([0] + [len(column) for column in columns])
+    return [pd.Categorical.from_codes(codes[start:stop], groups) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def alias_digest(jokeid_to_group):
+    """
+    Short hash of a jokeid -> group mapping, used with data_version to key caches built on the groups.
+    """
+    return hashlib.sha1(json.dumps(sorted(jokeid_to_group.items())).encode()).hexdigest()[:8]
@@ -0,0 +1,362 @@
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from joke_aggregates import score_stats
+from joke_encoding import encode_groups
+from joke_cooccurrence import _set_pairs
+from joke_data import DEFAULT_BATCH_SIZE, credentials_from_args, load_jokes, stream_new_jokes
+from profiling import profiled
+
+DEFAULT_STORE_PATH = os.path.join('cache', 'aggregates.npz')
+
+# Arrays of the store and their dtypes; the vocabularies are stored as strings. Transitions and pairs are
+# keyed by (first code << 32 | second code), kept sorted so new keys are merged in by binary search.
+# Sets are keyed by (day << 32 | venue code + 1) in sorted set_keys, with set_codes their interned codes.
+_ARRAYS = {
+    'joke_performances': np.int64, 'joke_count': np.int64, 'joke_sum': np.float64, 'joke_sumsq': np.float64,
+    'set_keys': np.int64, 'set_codes': np.int32, 'set_head': np.int32,
+    'entry_chunk': np.int32, 'entry_start': np.int64, 'entry_stop': np.int64, 'entry_next': np.int32,
+    'transition_key': np.int64, 'transition_count': np.int64, 'transition_sum': np.float64, 'transition_sumsq': np.float64,
+    'pair_key': np.int64, 'pair_count': np.int64, 'pair_sum': np.float64,
+}
+_VOCABULARIES = ['jokeids', 'venues']
+_SCALARS = ['high_water_id', 'last_set', 'last_joke']
+
+# Scored rows of one update, sorted by set; the set index points at (chunk, start, stop) spans of them
+_ROW = np.dtype([('joke', np.int32), ('score', np.float64)])
+
+# Day number of a missing date; rows without a date or venue never follow each other
+_NO_DATE = np.iinfo(np.int64).min
+
+
+def empty_store():
+    """
+    A store that has seen no rows yet.
+    """
+    store = {name: np.zeros(0, dtype=dtype) for name, dtype in _ARRAYS.items()}
+    store.update({name: np.zeros(0, dtype=object) for name in _VOCABULARIES})
+    store.update(high_water_id=0, last_set=-1, last_joke=-1, chunks=[], rows_path=None)
+    return store
+
+
+def _rows_path(path):
+    return os.path.splitext(path)[0] + '.rows'
+
+
+def _chunk_path(rows_path, chunk):
+    return os.path.join(rows_path, f'rows-{chunk:06d}.npy')
+
+
+def load_store(path=DEFAULT_STORE_PATH):
+    """
+    Load the aggregate store, or an empty one when it does not exist yet. The row chunks stay on disk and
+    are memory-mapped when a set they hold is revisited.
+    """
+    if not os.path.exists(path):
+        return empty_store()
+    with np.load(path) as f:
+        if 'n_chunks' not in f:
+            logging.warning("The aggregate store '%s' has an older layout; rebuilding it.", path)
+            return empty_store()
+        store = {name: f[name] for name in _ARRAYS}
+        store.update({name: f[name].astype(object) for name in _VOCABULARIES})
+        store.update({name: int(f[name]) for name in _SCALARS})
+        store['chunks'] = [None] * int(f['n_chunks'])
+    store['rows_path'] = _rows_path(path)
+    return store
+
+
+def _save_rows(store, path):
+    """
+    Write the row chunks that are only held in memory yet, one immutable .npy file each, and drop them from
+    memory. Chunk files beyond the saved chunk count are leftovers of an interrupted update and are overwritten.
+    """
+    rows_path = _rows_path(path)
+    for chunk, rows in enumerate(store['chunks']):
+        if rows is not None:
+            os.makedirs(rows_path, exist_ok=True)
+            with open(_chunk_path(rows_path, chunk) + '.tmp', 'wb') as f:
+                np.save(f, rows)
+            os.replace(_chunk_path(rows_path, chunk) + '.tmp', _chunk_path(rows_path, chunk))
+            store['chunks'][chunk] = None
+    store['rows_path'] = rows_path
+
+
+def save_store(store, path=DEFAULT_STORE_PATH):
+    """
+    Write the new row chunks next to the store, then the aggregates to one .npz file atomically, so a reader
+    never sees a half-updated store. Rows already on disk are not rewritten: a save costs the new rows plus
+    the aggregate tables, which grow with the distinct jokeids, sets, transitions and pairs.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    _save_rows(store, path)
+    arrays = {name: store[name] for name in _ARRAYS}
+    arrays.update({name: np.asarray(store[name], dtype=str) for name in _VOCABULARIES})
+    arrays.update({name: store[name] for name in _SCALARS})
+    np.savez(path + '.tmp.npz', n_chunks=len(store['chunks']), **arrays)
+    os.replace(path + '.tmp.npz', path)
+
+
+def _intern(vocabulary, values):
+    """
+    Integer codes of values in an append-only vocabulary, adding the values it does not have yet.
+    Missing values are -1. Returns (codes, vocabulary).
+    """
+    values = pd.Series(values, dtype=object)
+    codes = pd.Index(vocabulary).get_indexer(values)
+    new = values[(codes < 0) & values.notna()].unique()
+    if len(new):
+        vocabulary = np.concatenate([vocabulary, np.asarray(new, dtype=object)])
+        codes = pd.Index(vocabulary).get_indexer(values)
+    return codes.astype(np.int32), vocabulary
+
+
+def _grow(array, n, fill=0):
+    return np.pad(array, (0, n - len(array)), constant_values=fill) if len(array) < n else array
+
+
+def _key(first, second):
+    return (np.asarray(first, dtype=np.int64) << 32) | (np.asarray(second, dtype=np.int64) & 0xFFFFFFFF)
+
+
+def _split(keys):
+    return (keys >> 32).astype(np.int32), (keys & 0xFFFFFFFF).astype(np.int32)
+
+
+def _lookup(keys, codes, new_keys):
+    """
+    Codes of new_keys in the sorted keys, by binary search; -1 where a key is not there.
+    """
+    position = np.minimum(np.searchsorted(keys, new_keys), max(len(keys) - 1, 0))
+    found = (keys[position] == new_keys) if len(keys) else np.zeros(len(new_keys), dtype=bool)
+    return np.where(found, codes[position] if len(keys) else -1, -1)
+
+
+def _merge(store, prefix, keys, **deltas):
+    """
+    Add the values of the (unsorted, repeated) keys into the sorted prefix_key table of the store: the
+    deltas are summed per key first, then added in place where the key exists and inserted where it does
+    not, so only the new keys are sorted.
+    """
+    keys, inverse = np.unique(keys, return_inverse=True)
+    table = store[prefix + '_key']
+    position = np.searchsorted(table, keys)
+    found = position < len(table)
+    found[found] = table[position[found]] == keys[found]
+    for name, values in deltas.items():
+        column = store[f'{prefix}_{name}']
+        summed = np.bincount(inverse, weights=values, minlength=len(keys)).astype(column.dtype)
+        column[position[found]] += summed[found]
+        if not found.all():
+            store[f'{prefix}_{name}'] = np.insert(column, position[~found], summed[~found])
+    if not found.all():
+        store[prefix + '_key'] = np.insert(table, position[~found], keys[~found])
+
+
+def _stored_rows(store, sets):
+    """
+    The scored rows already stored for sets, read through the set index from the chunks that hold them.
+    Returns (set codes, joke codes, scores).
+    """
+    spans = []
+    for code in sets[store['set_head'][sets] >= 0]:
+        entry = store['set_head'][code]
+        while entry >= 0:
+            spans.append((store['entry_chunk'][entry], store['entry_start'][entry], store['entry_stop'][entry], code))
+            entry = store['entry_next'][entry]
+    parts, set_parts = [np.zeros(0, dtype=_ROW)], [np.zeros(0, dtype=np.int32)]
+    for chunk, start, stop, code in spans:
+        rows = store['chunks'][chunk]
+        if rows is None:
+            rows = np.load(_chunk_path(store['rows_path'], chunk), mmap_mode='r')
+        parts.append(np.asarray(rows[start:stop]))
+        set_parts.append(np.full(stop - start, code, dtype=np.int32))
+    rows = np.concatenate(parts)
+    return np.concatenate(set_parts), rows['joke'], rows['score']
+
+
+def _append_rows(store, sets, jokes, scores):
+    """
+    Append scored rows as a new chunk, sorted by set, and link each set's span of it into the set index.
+    """
+    order = np.argsort(sets, kind='stable')
+    sets = sets[order]
+    rows = np.empty(len(sets), dtype=_ROW)
+    rows['joke'], rows['score'] = jokes[order], scores[order]
+    codes, starts = np.unique(sets, return_index=True)
+    entries = len(store['entry_chunk']) + np.arange(len(codes), dtype=np.int32)
+    store['entry_chunk'] = np.r_[store['entry_chunk'], np.full(len(codes), len(store['chunks']), dtype=np.int32)]
+    store['entry_start'] = np.r_[store['entry_start'], starts]
+    store['entry_stop'] = np.r_[store['entry_stop'], np.r_[starts[1:], len(sets)]]
+    store['entry_next'] = np.r_[store['entry_next'], store['set_head'][codes]]
+    store['set_head'][codes] = entries
+    store['chunks'].append(rows)
+
+
+@profiled('incremental_update')
+def update_store(store, jokes):
+    """
+    Fold the rows of jokes with an id above the store's high-water mark into the running aggregates:
+    per-jokeid performance count and scored count/sum/sum of squares, per (preceding, current) transition
+    count/sum/sum of squares of the current score, and per pair of jokeids sharing a set the count and
+    summed average score (as in build_cooccurrence). The scored rows are kept in append-only chunks with a
+    set index, so only the stored rows of the sets the new rows belong to are read back; new transition
+    and pair keys are merged into the sorted tables by binary search. The table is assumed to be
+    append-only: rows at or below the high-water mark are ignored. Returns the number of rows added.
+    """
+    new = jokes[jokes['id'] > store['high_water_id']].sort_values('id')
+    if new.empty:
+        return 0
+
+    joke_codes, store['jokeids'] = _intern(store['jokeids'], new['jokeid'])
+    venue_codes, store['venues'] = _intern(store['venues'], new['venue'])
+    dates = new['date'].to_numpy(dtype='datetime64[D]').astype(np.int64)
+    scores = new['score'].to_numpy(dtype=np.float64, na_value=np.nan)
+    ids = new['id'].to_numpy(dtype=np.int64)
+
+    # Sets are (date, venue) keys, interned like the vocabularies
+    keys = _key(np.maximum(dates, np.iinfo(np.int32).min), venue_codes + 1)
+    set_codes = _lookup(store['set_keys'], store['set_codes'], keys)
+    fresh = np.unique(keys[set_codes < 0])
+    if len(fresh):
+        n_sets = len(store['set_head'])
+        position = np.searchsorted(store['set_keys'], fresh)
+        store['set_keys'] = np.insert(store['set_keys'], position, fresh)
+        store['set_codes'] = np.insert(store['set_codes'], position, np.arange(n_sets, n_sets + len(fresh), dtype=np.int32))
+        store['set_head'] = _grow(store['set_head'], n_sets + len(fresh), fill=-1)
+        set_codes = _lookup(store['set_keys'], store['set_codes'], keys)
+    set_codes = set_codes.astype(np.int32)
+
+    # Running per-jokeid statistics
+    n_jokes = len(store['jokeids'])
+    valid = joke_codes >= 0
+    scored = valid & ~np.isnan(scores)
+    for name in ('joke_performances', 'joke_count', 'joke_sum', 'joke_sumsq'):
+        store[name] = _grow(store[name], n_jokes)
+    store['joke_performances'] += np.bincount(joke_codes[valid], minlength=n_jokes)
+    store['joke_count'] += np.bincount(joke_codes[scored], minlength=n_jokes)
+    store['joke_sum'] += np.bincount(joke_codes[scored], weights=scores[scored], minlength=n_jokes)
+    store['joke_sumsq'] += np.bincount(joke_codes[scored], weights=scores[scored] ** 2, minlength=n_jokes)
+
+    # Transitions: a new row follows the row whose id is one less, when both are in the same dated set;
+    # that row is either new too or the last row stored
+    preceding_id = np.r_[store['high_water_id'], ids[:-1]]
+    preceding_set = np.r_[store['last_set'], set_codes[:-1]]
+    preceding_joke = np.r_[store['last_joke'], joke_codes[:-1]]
+    follows = ((preceding_id == ids - 1) & (preceding_set == set_codes) & (dates != _NO_DATE)
+               & (venue_codes >= 0) & (preceding_joke >= 0) & scored)
+    transition_scores = scores[follows]
+    n_transitions = len(transition_scores)
+    _merge(store, 'transition', _key(preceding_joke[follows], joke_codes[follows]),
+           count=np.ones(n_transitions), sum=transition_scores, sumsq=transition_scores ** 2)
+
+    # Co-occurrence: pairs of scored rows in the sets the new rows touched, with at least one new row
+    new_sets, new_jokes, new_scores = set_codes[scored], joke_codes[scored], scores[scored]
+    old_sets, old_jokes, old_scores = _stored_rows(store, np.unique(new_sets))
+    offset = len(old_sets)
+    row_set = np.r_[old_sets, new_sets]
+    row_joke = np.r_[old_jokes, new_jokes]
+    row_score = np.r_[old_scores, new_scores]
+    left, right = _set_pairs(row_set)
+    a, b = row_joke[left], row_joke[right]
+    keep = ((left >= offset) | (right >= offset)) & (a != b)
+    a, b, left, right = a[keep], b[keep], left[keep], right[keep]
+    pair_scores = (row_score[left] + row_score[right]) / 2
+    _merge(store, 'pair', np.r_[_key(a, b), _key(b, a)], count=np.ones(2 * len(a)), sum=np.r_[pair_scores, pair_scores])
+    _append_rows(store, new_sets, new_jokes, new_scores)
+
+    store['high_water_id'] = int(ids[-1])
+    store['last_set'], store['last_joke'] = int(set_codes[-1]), int(joke_codes[-1])
+    logging.info("Added %d rows (%d transitions, %d pairs) to the aggregate store, now up to id %d.",
+                 len(ids), n_transitions, len(a), store['high_water_id'])
+    return len(ids)
+
+
+def refresh_store(path=DEFAULT_STORE_PATH, source='mysql', credentials=None, batch_size=DEFAULT_BATCH_SIZE, **load_options):
+    """
+    Bring the store at path up to date with the jokes table and return it. From MySQL only the rows above
+    the high-water mark are fetched, streamed in id order and folded in one batch at a time; each batch's
+    rows are written out before the next is fetched, so memory follows the batch size and the aggregate
+    tables rather than the backlog. The dump and cache sources are read whole and filtered.
+    """
+    store = load_store(path)
+    if source == 'mysql':
+        batches = stream_new_jokes(store['high_water_id'], credentials, batch_size)
+    else:
+        batches = [load_jokes(source, credentials, **load_options)]
+    added = 0
+    for jokes in batches:
+        added += update_store(store, jokes)
+        _save_rows(store, path)
+    if added:
+        save_store(store, path)
+    return store
+
+
+def refresh_store_from_args(args, path=DEFAULT_STORE_PATH):
+    """
+    Refresh the store from the source and connection options parsed by add_source_arguments.
+    """
+    return refresh_store(path, args.source, credentials_from_args(args), dump_path=args.dump, cache_path=args.cache)
+
+
+def joke_score_stats(store):
+    """
+    Per-jokeid performance count and scored count, sum, mean and sample variance, indexed by jokeid.
+    """
+    stats = score_stats(store['joke_count'], store['joke_sum'], store['joke_sumsq'], pd.Index(store['jokeids'], name='jokeid'))
+    stats.insert(0, 'performances', store['joke_performances'])
+    return stats
+
+
+def _group_matrix(store, jokeid_to_group):
+    # Only jokeids with a scored row form groups, as when the groups are encoded from the scored rows
+    scored = store['joke_count'] > 0
+    codes, groups = encode_groups(np.where(scored, store['jokeids'], None), jokeid_to_group)
+    rows = np.flatnonzero(codes >= 0)
+    fold = sparse.csr_matrix((np.ones(len(rows)), (rows, codes[rows])), shape=(len(codes), len(groups)))
+    return fold, groups
+
+
+def group_stats(store, jokeid_to_group):
+    """
+    Count, sum, mean and sample variance of the scores of every jokeid group, as group_score_stats returns them.
+    """
+    fold, groups = _group_matrix(store, jokeid_to_group)
+    count, total, total_sq = (fold.T @ store[name] for name in ('joke_count', 'joke_sum', 'joke_sumsq'))
+    return score_stats(count.astype(np.int64), total, total_sq, pd.Index(groups, name='jokeid'))
+
+
+def group_cooccurrence(store, jokeid_to_group):
+    """
+    Fold the jokeid pair matrices into jokeid groups. Returns (sums, counts, groups) as build_cooccurrence
+    and encode_groups would for the whole table; pairs within one group are left out.
+    """
+    fold, groups = _group_matrix(store, jokeid_to_group)
+    n_jokes = len(store['jokeids'])
+    index = _split(store['pair_key'])
+    sums = (fold.T @ sparse.csr_matrix((store['pair_sum'], index), shape=(n_jokes, n_jokes)) @ fold).tocsr()
+    counts = (fold.T @ sparse.csr_matrix((store['pair_count'], index), shape=(n_jokes, n_jokes)) @ fold).tocsr()
+    sums = sums - sparse.diags(sums.diagonal())
+    counts = counts - sparse.diags(counts.diagonal())
+    counts.eliminate_zeros()
+    return sums.tocsr(), counts.astype(np.int32).tocsr(), groups
+
+
+def transition_stats(store):
+    """
+    Count, mean and sample variance of the current score of every (preceding, current) jokeid transition.
+    """
+    preceding, current = _split(store['transition_key'])
+    stats = score_stats(store['transition_count'], store['transition_sum'], store['transition_sumsq'])
+    return pd.DataFrame({
+        'preceding_jokeid': pd.Categorical.from_codes(preceding, store['jokeids']),
+        'current_jokeid': pd.Categorical.from_codes(current, store['jokeids']),
+        'count': stats['count'], 'avg_score': stats['mean'], 'var': stats['var'],
+    })
@@ -0,0 +1,139 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from profiling import profiled
+
+# Resampled scores drawn per batch, which bounds the memory of one batch to a few tens of MB
+_BATCH_DRAWS = 4_000_000
+
+# Below this many draws in total, a process pool costs more than it saves
+_PARALLEL_DRAWS = 20_000_000
+
+
+def _resample_means(codes, scores, counts, starts, n_groups, n_resamples, seed, prior_weight, prior_mean):
+    """
+    Bootstrap the (shrunk) mean score of every group n_resamples times: every resample redraws each group's
+    scores with replacement from that group's own scores. codes must be sorted, with group g's scores at
+    scores[starts[g]:starts[g] + counts[g]]. Returns a (n_resamples, n_groups) float32 array.
+    """
+    rng = np.random.default_rng(seed)
+    n = len(codes)
+    batch = max(1, _BATCH_DRAWS // max(n, 1))
+    row_counts, row_starts = counts[codes], starts[codes]
+    means = np.empty((n_resamples, n_groups), dtype=np.float32)
+    for first in range(0, n_resamples, batch):
+        size = min(batch, n_resamples - first)
+        draws = row_starts + (rng.random((size, n)) * row_counts).astype(np.int64)
+        cells = (np.arange(size)[:, None] * n_groups + codes).ravel()
+        sums = np.bincount(cells, weights=scores[draws].ravel(), minlength=size * n_groups).reshape(size, n_groups)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means[first:first + size] = (sums + prior_weight * prior_mean) / (counts + prior_weight)
+    return means
+
+
+@profiled('bootstrap')
+def bootstrap_intervals(codes, scores, n_groups, n_resamples=1000, alpha=0.05, prior_weight=5.0, prior_mean=None,
+                        seed=0, workers=None):
+    """
+    Percentile bootstrap intervals of the mean score of every group, for all groups at once. Every group
+    is resampled from its own scores in batched NumPy draws; the resamples are split across worker
+    processes when there are enough of them. The resampled statistic is the mean shrunk towards prior_mean
+    (the overall mean by default) with prior_weight pseudo-observations, so the intervals of rarely seen
+    groups are pulled in towards it. A group whose scores are all equal (one seen once, say) resamples to
+    the same value every time, so its interval has zero width at the shrunk mean; shrinkage_intervals
+    gives such groups a width from the pooled variance instead.
+    Returns a frame indexed by group code with count, mean, shrunk, low and high columns.
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    scores = np.asarray(scores, dtype=np.float64)
+    valid = (codes >= 0) & ~np.isnan(scores)
+    codes, scores = codes[valid], scores[valid]
+    order = np.argsort(codes, kind='stable')
+    codes, scores = codes[order], scores[order]
+
+    counts = np.bincount(codes, minlength=n_groups)
+    starts = np.cumsum(counts) - counts
+    totals = np.bincount(codes, weights=scores, minlength=n_groups)
+    prior_mean = scores.mean() if prior_mean is None else prior_mean
+
+    workers = workers or os.cpu_count() or 1
+    shared = (codes, scores, counts, starts, n_groups)
+    options = (prior_weight, prior_mean)
+    if workers > 1 and n_resamples * len(codes) >= _PARALLEL_DRAWS:
+        sizes = [len(part) for part in np.array_split(np.arange(n_resamples), workers) if len(part)]
+        seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+        with ProcessPoolExecutor(max_workers=len(sizes)) as executor:
+            parts = executor.map(_resample_means, *zip(*[shared + (size, child) + options for size, child in zip(sizes, seeds)]))
+            means = np.concatenate(list(parts))
+    else:
+        means = _resample_means(*shared, n_resamples, seed, *options)
+
+    low, high = np.nanquantile(means.astype(np.float64), [alpha / 2, 1 - alpha / 2], axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = totals / counts
+        shrunk = (totals + prior_weight * prior_mean) / (counts + prior_weight)
+    # The resamples are kept in float32; keep its rounding from moving a bound past the shrunk mean, and
+    # give the groups whose scores are all equal their exact zero-width interval
+    low, high = np.fmin(low, shrunk), np.fmax(high, shrunk)
+    seen = counts > 0
+    constant = np.zeros(n_groups, dtype=bool)
+    if seen.any():
+        constant[seen] = np.minimum.reduceat(scores, starts[seen]) == np.maximum.reduceat(scores, starts[seen])
+    low[constant] = high[constant] = shrunk[constant]
+    logging.info("Bootstrapped %d groups with %d resamples.", n_groups, n_resamples)
+    return pd.DataFrame({'count': counts, 'mean': mean, 'shrunk': shrunk, 'low': low, 'high': high})
+
+
+def shrinkage_intervals(codes, scores, n_groups, alpha=0.05, prior_weight=5.0, prior_mean=None):
+    """
+    Closed-form alternative to bootstrap_intervals: normal intervals around the mean shrunk towards
+    prior_mean, with the pooled within-group variance spread over count + prior_weight observations.
+    Returns the same frame as bootstrap_intervals.
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    scores = np.asarray(scores, dtype=np.float64)
+    valid = (codes >= 0) & ~np.isnan(scores)
+    codes, scores = codes[valid], scores[valid]
+
+    counts = np.bincount(codes, minlength=n_groups)
+    totals = np.bincount(codes, weights=scores, minlength=n_groups)
+    totals_sq = np.bincount(codes, weights=scores * scores, minlength=n_groups)
+    prior_mean = scores.mean() if prior_mean is None else prior_mean
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = totals / counts
+        within = totals_sq - np.where(counts > 0, totals * mean, 0)
+    pooled = within.sum() / max(len(scores) - (counts > 0).sum(), 1)
+
+    shrunk = (totals + prior_weight * prior_mean) / (counts + prior_weight)
+    half = stats.norm.ppf(1 - alpha / 2) * np.sqrt(pooled / (counts + prior_weight))
+    return pd.DataFrame({'count': counts, 'mean': mean, 'shrunk': shrunk, 'low': shrunk - half, 'high': shrunk + half})
+
+
+def score_intervals(codes, scores, n_groups, method='bootstrap', **options):
+    """
+    Intervals of the mean score of every group with the chosen method ('bootstrap' or 'shrinkage').
+    """
+    if method == 'bootstrap':
+        return bootstrap_intervals(codes, scores, n_groups, **options)
+    if method == 'shrinkage':
+        options.pop('n_resamples', None)
+        options.pop('seed', None)
+        options.pop('workers', None)
+        return shrinkage_intervals(codes, scores, n_groups, **options)
+    raise ValueError(f"Unknown interval method '{method}'")
+
+
+def share_intervals(successes, trials, alpha=0.05):
+    """
+    Jeffreys (Beta(1/2, 1/2) prior) intervals of a share successes / trials, vectorized over arrays.
+    """
+    successes = np.asarray(successes, dtype=np.float64)
+    trials = np.asarray(trials, dtype=np.float64)
+    low = np.where(successes > 0, stats.beta.ppf(alpha / 2, successes + 0.5, trials - successes + 0.5), 0.0)
+    high = np.where(successes < trials, stats.beta.ppf(1 - alpha / 2, successes + 0.5, trials - successes + 0.5), 1.0)
+    return low, high
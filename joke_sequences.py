@@ -0,0 +1,194 @@
+import logging
+import os
+
+import numpy as np
+
+from joke_encoding import alias_digest, encode_groups
+from joke_data import data_version
+from profiling import profiled
+
+DEFAULT_CACHE_DIR = 'cache'
+
+# Orders of the n-gram tables built for the set-list model
+NGRAM_ORDERS = (1, 2, 3)
+
+
+@profiled('sequences')
+def build_sequences(jokes, jokeid_to_group):
+    """
+    Build the set-sequence store: every (date, venue) set as a run of int32 canonical jokeid group codes,
+    ordered by id, in one flat buffer. Set i is codes[offsets[i]:offsets[i + 1]], with the matching scores
+    (NaN when unscored). Rows without a date or venue belong to no set; rows without a jokeid are -1.
+    """
+    sets = jokes.dropna(subset=['date', 'venue'])
+    codes, groups = encode_groups(sets['jokeid'], jokeid_to_group)
+
+    venue_codes = sets['venue'].cat.codes.to_numpy()
+    dates = sets['date'].to_numpy()
+    order = np.lexsort((sets['id'].to_numpy(), venue_codes, dates))
+    dates, venue_codes = dates[order], venue_codes[order]
+    starts = np.flatnonzero(np.r_[True, (dates[1:] != dates[:-1]) | (venue_codes[1:] != venue_codes[:-1])])
+
+    return {
+        'codes': codes[order],
+        'scores': sets['score'].to_numpy(dtype=np.float32, na_value=np.nan)[order],
+        'offsets': np.r_[starts, len(order)].astype(np.int64),
+        'groups': groups,
+    }
+
+
+def _ngram_keys(sequences, n):
+    """
+    Flattened n-gram keys of every position of every set, in base n_groups + 1. Positions before the start
+    of a set are padded with the start token n_groups, so openers get n-grams of their own.
+    Returns (keys, valid) where valid marks positions whose n-gram has no missing jokeid.
+    """
+    codes = sequences['codes'].astype(np.int64)
+    start_token = len(sequences['groups'])
+    base = start_token + 1
+    offsets = sequences['offsets']
+    position = np.arange(len(codes)) - np.repeat(offsets[:-1], np.diff(offsets))
+
+    keys = codes.copy()
+    valid = codes >= 0
+    for k in range(1, n):
+        previous = np.where(position >= k, np.roll(codes, k), start_token)
+        valid &= previous >= 0
+        keys += previous * base ** k
+    return keys, valid
+
+
+@profiled('ngrams')
+def build_ngram_table(sequences, n):
+    """
+    Sparse n-gram score table: for every observed (context..., joke) n-gram of consecutive jokes in a set,
+    the count and summed score of the last joke. Stored as sorted flat keys so lookups are one searchsorted.
+    """
+    keys, valid = _ngram_keys(sequences, n)
+    scores = sequences['scores'].astype(np.float64)
+    valid &= ~np.isnan(scores)
+    unique, inverse = np.unique(keys[valid], return_inverse=True)
+    return {
+        'keys': unique,
+        'counts': np.bincount(inverse, minlength=len(unique)).astype(np.int64),
+        'sums': np.bincount(inverse, weights=scores[valid], minlength=len(unique)),
+    }
+
+
+def ngram_lookup(table, keys):
+    """
+    Counts and summed scores of the given flat n-gram keys; unseen n-grams have a count of 0.
+    """
+    keys = np.asarray(keys, dtype=np.int64)
+    index = np.minimum(np.searchsorted(table['keys'], keys), max(len(table['keys']) - 1, 0))
+    found = table['keys'][index] == keys if len(table['keys']) else np.zeros(keys.shape, dtype=bool)
+    return np.where(found, table['sums'][index], 0.0), np.where(found, table['counts'][index], 0)
+
+
+def _model_path(jokes, jokeid_to_group, cache_dir):
+    return os.path.join(cache_dir, f"sequences-{data_version(jokes)}-{alias_digest(jokeid_to_group)}.npz")
+
+
+def load_model(jokes, jokeid_to_group, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Return the set-sequence store and its n-gram tables for this version of the jokes table and alias
+    mapping, building and caching them on first use.
+    """
+    path = _model_path(jokes, jokeid_to_group, cache_dir)
+    if os.path.exists(path):
+        logging.info("Reading set sequences from %s.", path)
+        with np.load(path) as f:
+            sequences = {name: f[name] for name in ('codes', 'scores', 'offsets')}
+            sequences['groups'] = f['groups'].astype(object)
+            tables = {n: {name: f[f"ngram{n}_{name}"] for name in ('keys', 'counts', 'sums')} for n in NGRAM_ORDERS}
+        return sequences, tables
+
+    sequences = build_sequences(jokes, jokeid_to_group)
+    tables = {n: build_ngram_table(sequences, n) for n in NGRAM_ORDERS}
+
+    arrays = {name: sequences[name] for name in ('codes', 'scores', 'offsets')}
+    arrays['groups'] = np.asarray(sequences['groups'], dtype=str)
+    for n, table in tables.items():
+        arrays.update({f"ngram{n}_{name}": values for name, values in table.items()})
+    os.makedirs(cache_dir or '.', exist_ok=True)
+    np.savez(path + '.tmp.npz', **arrays)
+    os.replace(path + '.tmp.npz', path)
+    logging.info("Built %d set sequences and saved them to %s.", len(sequences['offsets']) - 1, path)
+    return sequences, tables
+
+
+def transition_estimates(tables, n_groups, candidates, prior_weight=5.0):
+    """
+    Expected score of every candidate given the two jokes before it, as a dense (k + 1, k + 1, k) array
+    for k candidate group codes; index k stands for the start of the set. Sparse n-grams are shrunk towards
+    the next shorter context: trigram -> bigram -> the joke's own mean -> the overall mean, each with
+    prior_weight pseudo-observations. Candidates with a code of -1 (never seen) get the overall mean.
+    """
+    candidates = np.asarray(candidates, dtype=np.int64)
+    base = n_groups + 1
+    context = np.r_[candidates, n_groups]
+    overall = tables[1]['sums'].sum() / max(tables[1]['counts'].sum(), 1)
+
+    def lookup(table, keys, known):
+        sums, counts = ngram_lookup(table, keys)
+        return np.where(known, sums, 0.0), np.where(known, counts, 0)
+
+    known = candidates >= 0
+    sums, counts = lookup(tables[1], candidates, known)
+    unigram = (sums + prior_weight * overall) / (counts + prior_weight)
+
+    known_context = context >= 0
+    keys = candidates[None, :] + context[:, None] * base
+    sums, counts = lookup(tables[2], keys, known[None, :] & known_context[:, None])
+    bigram = (sums + prior_weight * unigram[None, :]) / (counts + prior_weight)
+
+    keys = candidates[None, None, :] + context[None, :, None] * base + context[:, None, None] * base ** 2
+    sums, counts = lookup(tables[3], keys, known[None, None, :] & known_context[None, :, None] & known_context[:, None, None])
+    return (sums + prior_weight * bigram[None, :, :]) / (counts + prior_weight)
+
+
+def beam_search(estimates, length=None, beam_width=64):
+    """
+    Order the candidates to maximise the summed expected score, keeping the beam_width best partial set
+    lists at every step. estimates is the (k + 1, k + 1, k) array of transition_estimates. Returns
+    (order, expected scores per position) for a set list of length jokes (all candidates by default).
+    """
+    k = estimates.shape[2]
+    length = min(length or k, k)
+    start = k
+
+    sequences = np.empty((1, 0), dtype=np.int64)
+    used = np.zeros((1, k), dtype=bool)
+    totals = np.zeros(1)
+    steps = np.empty((1, 0))
+    for step in range(length):
+        previous = sequences[:, -1] if step >= 1 else np.full(len(sequences), start)
+        before = sequences[:, -2] if step >= 2 else np.full(len(sequences), start)
+        gains = np.where(used, -np.inf, estimates[before, previous])
+        candidate_totals = (totals[:, None] + gains).ravel()
+
+        # Keep the best beam_width extensions
+        width = min(beam_width, np.isfinite(candidate_totals).sum())
+        best = np.argpartition(-candidate_totals, width - 1)[:width]
+        beam, joke = np.divmod(best, k)
+        sequences = np.column_stack([sequences[beam], joke])
+        used = used[beam]
+        used[np.arange(width), joke] = True
+        steps = np.column_stack([steps[beam], gains[beam, joke]])
+        totals = candidate_totals[best]
+
+    best = np.argmax(totals)
+    return sequences[best], steps[best]
+
+
+def propose_set_list(tables, groups, candidates, length=None, beam_width=64, prior_weight=5.0):
+    """
+    Propose a high-scoring order for the candidate jokeid groups. Returns a list of
+    (group, expected score) pairs in performance order.
+    """
+    index = {group: i for i, group in enumerate(groups)}
+    candidates = list(dict.fromkeys(candidates))
+    codes = [index.get(group, -1) for group in candidates]
+    estimates = transition_estimates(tables, len(groups), codes, prior_weight)
+    order, gains = beam_search(estimates, length, beam_width)
+    return [(candidates[i], float(gain)) for i, gain in zip(order, gains)]
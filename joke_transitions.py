@@ -0,0 +1,75 @@
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from joke_data import data_version
+from profiling import profiled
+
+DEFAULT_CACHE_DIR = 'cache'
+
+
+@profiled('transitions')
+def build_transition_table(jokes):
+    """
+    Build the table of every (preceding -> current) joke transition in the jokes table.
+    Rows are sorted by (date, venue, id); a row's preceding joke is the row right before it when it
+    belongs to the same set and its id is one less. Rows without a date or venue never pair, as in SQL.
+    Each transition carries how often both jokeids occur in the whole table, so frequency filters are masks.
+    """
+    counts = jokes['jokeid'].value_counts()
+    sets = jokes.dropna(subset=['date', 'venue'])
+
+    venue_codes = sets['venue'].cat.codes.to_numpy()
+    dates = sets['date'].to_numpy()
+    ids = sets['id'].to_numpy()
+    order = np.lexsort((ids, venue_codes, dates))
+    dates, venue_codes, ids = dates[order], venue_codes[order], ids[order]
+
+    follows = (dates[1:] == dates[:-1]) & (venue_codes[1:] == venue_codes[:-1]) & (ids[1:] == ids[:-1] + 1)
+    current = sets.iloc[order[1:][follows]]
+    preceding = sets.iloc[order[:-1][follows]]
+
+    return pd.DataFrame({
+        'current_jokeid': current['jokeid'].array,
+        'current_score': current['score'].array,
+        'preceding_jokeid': preceding['jokeid'].array,
+        'current_count': counts.reindex(current['jokeid']).fillna(0).to_numpy(dtype=np.int32),
+        'preceding_count': counts.reindex(preceding['jokeid']).fillna(0).to_numpy(dtype=np.int32),
+    })
+
+
+def load_transition_table(jokes, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Return the transition table for this version of the jokes table, building and caching it on first use.
+    """
+    path = os.path.join(cache_dir, f"transitions-{data_version(jokes)}.parquet")
+    if os.path.exists(path):
+        logging.info("Reading transition table from %s.", path)
+        return pd.read_parquet(path)
+
+    transitions = build_transition_table(jokes)
+    os.makedirs(cache_dir or '.', exist_ok=True)
+    transitions.to_parquet(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+    logging.info("Built transition table with %d rows and saved it to %s.", len(transitions), path)
+    return transitions
+
+
+def preceding_joke_pairs(jokes, min_count=10, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Pair every scored joke with the joke performed right before it in the same set (date + venue),
+    keeping only jokes performed at least min_count times.
+    Returns a frame with current_jokeid, current_score and preceding_jokeid columns; the jokeid columns are
+    categoricals sharing the jokes table's vocabulary.
+    """
+    transitions = load_transition_table(jokes, cache_dir)
+    keep = ((transitions['current_count'] >= min_count) & (transitions['preceding_count'] >= min_count)
+            & transitions['current_score'].notna())
+    pairs = transitions[keep]
+    return pd.DataFrame({
+        'current_jokeid': pairs['current_jokeid'],
+        'current_score': pairs['current_score'].astype(float),
+        'preceding_jokeid': pairs['preceding_jokeid'],
+    }).reset_index(drop=True)
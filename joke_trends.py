@@ -0,0 +1,106 @@
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from joke_clustering import update_alias_table
+from joke_data import add_source_arguments, load_jokes_from_args
+from joke_encoding import vocabulary_groups
+from profiling import add_profile_arguments, enable_from_args, profiled
+from time_series import parse_window, period_window, resample, rolling_mean, sort_by_date, window
+import logging
+import argparse
+
+def group_rows(jokes, jokeid, jokeid_to_group):
+    """
+    Mask of the rows whose jokeid is in the same alias group as jokeid. The group mapping is applied to
+    the jokeid vocabulary only; rows are matched on their categorical codes.
+    """
+    vocabulary = jokes['jokeid'].cat.categories
+    codes, groups = vocabulary_groups(vocabulary, jokeid_to_group)
+    group = jokeid_to_group.get(jokeid, jokeid)
+    members = vocabulary[codes == np.searchsorted(groups, group)] if group in set(groups) else []
+    return jokes['jokeid'].isin(members).to_numpy()
+
+@profiled('score_trend')
+def score_trend(jokes, jokeid=None, jokeid_to_group=None, start=None, end=None, freq='W', rolling=4):
+    """
+    Count and mean score per period of one jokeid group (or of every joke) inside the [start, end) window,
+    widened to whole periods, with a rolling mean over the last rolling periods. The jokes are sorted by date
+    once and the window is found by binary search, so only the rows inside it are aggregated.
+    """
+    start, end = period_window(start, end, freq)
+    timeline = window(sort_by_date(jokes, 'date', 'id'), 'date', start, end)
+    if jokeid is not None:
+        timeline = timeline[group_rows(timeline, jokeid, jokeid_to_group or {})]
+
+    scores = timeline['score'].to_numpy(dtype=np.float64, na_value=np.nan)
+    periods, sums, counts = resample(timeline['date'], scores, freq, start=start, end=end)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = sums[:, 0] / counts[:, 0]
+    return pd.DataFrame({
+        'count': counts[:, 0],
+        'mean': mean,
+        'rolling_mean': rolling_mean(sums, counts, rolling)[:, 0] if len(periods) else mean,
+    }, index=pd.Index(periods, name='period'))
+
+@profiled('render')
+def plot_trend(trend, title, path='joke_trend.png'):
+    """
+    Plot the mean score per period and its rolling mean.
+    """
+    plt.figure(figsize=(10, 5))
+    times = trend.index.start_time
+    plt.plot(times, trend['mean'], marker='o', linestyle='', color='skyblue', label='Mean score')
+    plt.plot(times, trend['rolling_mean'], color='navy', label='Rolling mean')
+    plt.xlabel('Period')
+    plt.ylabel('Score')
+    plt.title(title)
+    plt.legend()
+    plt.tight_layout()
+    plt.savefig(path)
+    logging.info("Trend chart saved as '%s'.", path)
+
+def main():
+    # Set up command-line argument parsing
+    parser = argparse.ArgumentParser(description='Show how a joke (or every joke) has scored over time.')
+    parser.add_argument('jokeid', nargs='?', help='The jokeid to follow; its alias group is included (default: all jokes).')
+    parser.add_argument('--last', help='Only look at this much time before the last performance (e.g. 6M, 30D, 2W, 1Y).')
+    parser.add_argument('--start', help='First date of the window (e.g. 2023-01-01).')
+    parser.add_argument('--end', help='Date the window ends before (exclusive).')
+    parser.add_argument('--freq', default='W', help="Period to average over: a pandas period such as 'W', 'M' or 'Q'.")
+    parser.add_argument('--rolling', type=int, default=4, help='Number of periods in the rolling mean.')
+    parser.add_argument('--alias_table', type=str, default='joke_aliases.json', help='Path of the persisted jokeid alias table.')
+    parser.add_argument('--plot', help='Also save a chart of the trend to this image.')
+    add_source_arguments(parser)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    if args.rolling < 1:
+        parser.error('--rolling must be at least 1')
+
+    # Set up logging to write to a file
+    logging.basicConfig(filename='jokes_analysis.log',
+                        level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    enable_from_args(args)
+
+    jokes = load_jokes_from_args(args)
+    jokeid_to_group = update_alias_table(jokes['jokeid'].cat.categories, args.alias_table) if args.jokeid else None
+    if args.jokeid:
+        rows = group_rows(jokes, args.jokeid, jokeid_to_group)
+        if not rows.any():
+            parser.error(f"no performances of jokeid '{args.jokeid}'")
+    if args.jokeid and args.last and not args.end:
+        # A relative window ends at the joke's own last performance
+        latest = jokes['date'][rows].max()
+    else:
+        latest = jokes['date'].max()
+    start, end = parse_window(args.start, args.end, args.last, None if pd.isna(latest) else latest)
+
+    trend = score_trend(jokes, args.jokeid, jokeid_to_group, start, end, args.freq, args.rolling)
+    title = f"Scores of \"{args.jokeid or 'all jokes'}\" per {args.freq}"
+    print(title)
+    print(trend.to_string(float_format=lambda value: f"{value:.2f}"))
+    if args.plot:
+        plot_trend(trend, title, args.plot)
+
+if __name__ == "__main__":
+    main()
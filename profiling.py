@@ -0,0 +1,217 @@
+import atexit
+import functools
+import json
+import logging
+import os
+import resource
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Completed stages and Chrome trace events are only collected once enable() has been called; stage
+# timings are logged either way. Stages are meant to be opened from one thread.
+_enabled = False
+_trace_path = None
+_trace_memory = False
+_records = []
+_events = []
+_open = []
+_origin = time.perf_counter()
+
+
+def reset_peak_rss():
+    """
+    Reset the kernel's resident set high-water mark so it can be read per stage (Linux only).
+    Returns whether the reset worked.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of the process in MB since the last reset_peak_rss().
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 2 ** 10
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+
+
+class Stage:
+    """
+    Measurements of one pipeline stage. rows and any extra args can be filled in inside the with block.
+    """
+
+    def __init__(self, name, rows=None, args=None):
+        self.name = name
+        self.rows = rows
+        self.args = dict(args or {})
+        self.seconds = None
+        self.cpu_seconds = None
+        self.start_rss_mb = None
+        self.peak_rss_mb = 0.0
+        self.peak_traced_mb = None
+        self.peak_rss_per_stage = False
+
+    def as_dict(self):
+        record = {
+            'seconds': round(self.seconds, 4),
+            'cpu_seconds': round(self.cpu_seconds, 4),
+            'start_rss_mb': round(self.start_rss_mb, 1),
+            'peak_rss_mb': round(self.peak_rss_mb, 1),
+            # Without a per-stage reset the peak is the process-wide peak so far
+            'peak_rss_per_stage': self.peak_rss_per_stage,
+            'rows': self.rows,
+        }
+        if self.peak_traced_mb is not None:
+            record['peak_traced_mb'] = round(self.peak_traced_mb, 2)
+        record.update(self.args)
+        return record
+
+
+def row_count(value):
+    """
+    Number of rows of a frame, series or array result, or None for anything else.
+    """
+    shape = getattr(value, 'shape', None)
+    return int(shape[0]) if shape else None
+
+
+@contextmanager
+def stage(name, rows=None, **args):
+    """
+    Time a pipeline stage and record its wall time, CPU time, peak RSS, row count and, when memory tracing
+    is on, the peak of Python allocations. Stages can be nested; an inner stage does not hide the peak
+    of the stage around it.
+    """
+    record = Stage(name, rows, args)
+
+    # The high-water marks are about to be reset, so fold them into the stages that are already open
+    current = peak_rss_mb()
+    current_traced = tracemalloc.get_traced_memory()[1] / 2 ** 20 if tracemalloc.is_tracing() else None
+    for outer in _open:
+        outer.peak_rss_mb = max(outer.peak_rss_mb, current)
+        if current_traced is not None:
+            outer.peak_traced_mb = max(outer.peak_traced_mb or 0.0, current_traced)
+    record.peak_rss_per_stage = reset_peak_rss()
+    record.start_rss_mb = peak_rss_mb()
+
+    traced = _trace_memory and not tracemalloc.is_tracing()
+    if traced:
+        tracemalloc.start()
+    elif _trace_memory:
+        tracemalloc.reset_peak()
+
+    _open.append(record)
+    start, start_cpu = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    finally:
+        record.seconds = time.perf_counter() - start
+        record.cpu_seconds = time.process_time() - start_cpu
+        record.peak_rss_mb = max(record.peak_rss_mb, peak_rss_mb())
+        _open.pop()
+        if _trace_memory:
+            record.peak_traced_mb = max(record.peak_traced_mb or 0.0, tracemalloc.get_traced_memory()[1] / 2 ** 20)
+        if traced:
+            tracemalloc.stop()
+
+        logging.info("Stage %s: %.3fs wall, %.3fs cpu, %.1f MB peak RSS, %s rows",
+                     name, record.seconds, record.cpu_seconds, record.peak_rss_mb, record.rows)
+        if _enabled:
+            _records.append(record)
+            _events.append({
+                'name': name,
+                'cat': 'stage',
+                'ph': 'X',
+                'ts': round((start - _origin) * 1e6, 1),
+                'dur': round(record.seconds * 1e6, 1),
+                'pid': os.getpid(),
+                'tid': 0,
+                'args': record.as_dict(),
+            })
+
+
+def profiled(name=None):
+    """
+    Decorator running the function as a stage, with the rows of its result as the row count.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name or func.__name__) as record:
+                result = func(*args, **kwargs)
+                record.rows = row_count(result)
+                return result
+        return wrapper
+    return decorate
+
+
+def log_every(every, i, level, msg, *args):
+    """
+    Log a progress message for every every-th iteration only, formatting it lazily, so it can sit in a hot loop.
+    """
+    if i % every == 0 and logging.getLogger().isEnabledFor(level):
+        logging.log(level, msg, *args)
+
+
+def enable(trace_path=None, trace_memory=False):
+    """
+    Start collecting stage records, and write them as a Chrome trace (chrome://tracing, Perfetto) to
+    trace_path when the process exits. trace_memory also traces the peak of Python allocations per stage,
+    which slows allocation-heavy stages down several times.
+    """
+    global _enabled, _trace_path, _trace_memory
+    if trace_path and not _trace_path:
+        atexit.register(write_trace)
+    _enabled = True
+    _trace_path = os.path.abspath(trace_path) if trace_path else _trace_path
+    _trace_memory = trace_memory
+
+
+def records():
+    """
+    Return the stages completed since enable() was called, in completion order.
+    """
+    return list(_records)
+
+
+def write_trace(path=None):
+    """
+    Write the collected stages as a Chrome trace event file.
+    """
+    path = path or _trace_path
+    if not path:
+        return
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'traceEvents': _events, 'displayTimeUnit': 'ms'}, f)
+    os.replace(path + '.tmp', path)
+    logging.info("Wrote %d stage events to %s.", len(_events), path)
+
+
+def add_profile_arguments(parser):
+    """
+    Add the --profile and --trace_memory options shared by the scripts.
+    """
+    parser.add_argument('--profile', metavar='PATH', help='Write a Chrome trace of the pipeline stages to this JSON file.')
+    parser.add_argument('--trace_memory', action='store_true', help='Also trace the peak of Python allocations per stage (slow).')
+
+
+def enable_from_args(args):
+    """
+    Enable stage collection when --profile or --trace_memory was given.
+    """
+    if args.profile or args.trace_memory:
+        enable(args.profile, args.trace_memory)
@@ -1,42 +1,41 @@
-import mysql.connector
-import pandas as pd
 import networkx as nx
 import pyvista as pv
 import numpy as np
-from fuzzywuzzy import fuzz, process
+from pandas.api.types import union_categoricals
+from joke_clustering import cluster_jokeids
+from joke_data import add_source_arguments, load_jokes_from_args
+from joke_encoding import as_categorical, group_categoricals
+from joke_intervals import score_intervals
+from joke_transitions import preceding_joke_pairs
+from graph_layout import layout_graph
+from profiling import add_profile_arguments, enable_from_args, profiled
 import argparse
+import os
 
+@profiled('fuzzy_group_jokes')
 def fuzzy_group_jokes(df, threshold=70):
     """
     Group similar joke IDs using fuzzy string matching.
     Jokes with a similarity score greater than or equal to the threshold will be grouped.
     The shortest joke ID in each group will be used as the canonical group ID.
     """
-    jokeid_list = df['current_jokeid'].unique()
-    jokeid_to_group = {}
-
-    # Iterate through all jokeids and group them by similarity
-    for jokeid in jokeid_list:
-        # Check if the jokeid is already grouped
-        if jokeid not in jokeid_to_group:
-            # Find all similar jokeids based on the threshold
-            similar_jokes = process.extractBests(jokeid, jokeid_list, scorer=fuzz.token_sort_ratio, score_cutoff=threshold)
-            group = [joke[0] for joke in similar_jokes]
-            
-            # Find the shortest joke ID in the group to use as the canonical group ID
-            shortest_jokeid = min(group, key=len)
-
-            # Map all jokes in the group to the shortest joke ID
-            for similar_joke in group:
-                jokeid_to_group[similar_joke] = shortest_jokeid
-
-    # Replace both current and preceding joke IDs with the group ID
-    df['current_jokeid'] = df['current_jokeid'].map(jokeid_to_group)
-    df['preceding_jokeid'] = df['preceding_jokeid'].map(jokeid_to_group)
+    # Cluster every distinct joke ID (current and preceding) in one batch
+    columns = [as_categorical(df['current_jokeid']), as_categorical(df['preceding_jokeid'])]
+    jokeid_list = union_categoricals(columns, ignore_order=True).remove_unused_categories().categories
+    jokeid_to_group = cluster_jokeids(jokeid_list, threshold=threshold, token_sort=True)
+
+    # Recode both current and preceding joke IDs to group codes over one shared group vocabulary
+    df['current_jokeid'], df['preceding_jokeid'] = group_categoricals(columns, jokeid_to_group)
 
     return df
 
-def analyze_jokes(df):
+@profiled('analyze_jokes')
+def analyze_jokes(df, method='bootstrap', n_resamples=1000, prior_weight=5.0, seed=0):
+    """
+    Find the best preceding joke of every joke. Every (current, preceding) pair gets an interval of its
+    average score (see joke_intervals), and the best preceding joke is the one with the highest lower
+    bound, so a pairing seen twice does not beat one seen forty times on a slightly higher average.
+    """
     # Drop rows where the preceding_jokeid is null (first jokes in sets)
     df = df.dropna(subset=['preceding_jokeid'])
 
@@ -44,17 +43,24 @@ def analyze_jokes(df):
     df = df.dropna(subset=['current_score'])
 
     # Group by current jokeid and preceding jokeid, calculate average score and count
-    grouped = df.groupby(['current_jokeid', 'preceding_jokeid']).agg(
+    pairs = df.groupby(['current_jokeid', 'preceding_jokeid'], observed=True)
+    grouped = pairs.agg(
         avg_score=('current_score', 'mean'),
         count=('current_score', 'size')
     ).reset_index()
 
+    # Intervals of every pair's average score at once, over the integer pair codes
+    intervals = score_intervals(pairs.ngroup().to_numpy(), df['current_score'].to_numpy(dtype=float), len(grouped),
+                                method=method, n_resamples=n_resamples, prior_weight=prior_weight, seed=seed)
+    grouped['ci_low'] = intervals['low'].to_numpy()
+    grouped['ci_high'] = intervals['high'].to_numpy()
+
     # Ensure there are no NaN values in avg_score before selecting the best joke
     grouped = grouped.dropna(subset=['avg_score'])
     grouped.to_csv("grouped_filter_no_sort.csv")
 
-    # Find the best preceding joke for each current joke (highest average score)
-    best_preceding_jokes = grouped.loc[grouped.groupby('current_jokeid')['avg_score'].idxmax()]
+    # Find the best preceding joke for each current joke (highest lower bound of the average score)
+    best_preceding_jokes = grouped.loc[grouped.groupby('current_jokeid', observed=True)['ci_low'].idxmax()]
 
     # Sort by count in descending order
     best_preceding_jokes = best_preceding_jokes.sort_values(by='count', ascending=False)
@@ -68,53 +74,66 @@ def analyze_jokes(df):
 
     return best_preceding_jokes
 
-def plot_top_joke_network(best_preceding_jokes):
+def build_network_meshes(G, pos):
+    """
+    Build the combined meshes for a joke network: one glyphed sphere mesh for all nodes, one line set for
+    all edges and one glyphed arrow mesh with a per-edge scale and 'avg_score' colour.
+    Returns (nodes, edges, arrows, node_positions).
+    """
+    nodes = list(G.nodes())
+    node_index = {node: i for i, node in enumerate(nodes)}
+    node_positions = np.array([pos[node] for node in nodes], dtype=float)
+
+    # Glyph a sphere at every node position in one mesh
+    node_mesh = pv.PolyData(node_positions).glyph(geom=pv.Sphere(radius=0.05), scale=False, orient=False)
+
+    # All edges as one line set over the node positions
+    edge_list = [(u, v) for u, v in G.edges() if u != v]
+    sources = np.array([node_index[u] for u, _ in edge_list], dtype=np.int64)
+    targets = np.array([node_index[v] for _, v in edge_list], dtype=np.int64)
+    lines = np.column_stack([np.full(len(edge_list), 2), sources, targets]).ravel()
+    edge_mesh = pv.PolyData(node_positions, lines=lines)
+
+    # Compute the direction and length of every edge
+    starts = node_positions[sources]
+    direction = node_positions[targets] - starts
+    length = np.linalg.norm(direction, axis=1)
+
+    # Glyph one arrow per edge, oriented along the edge and scaled to 0.9 of its length
+    arrow_points = pv.PolyData(starts)
+    arrow_points['direction'] = direction / length[:, None]
+    arrow_points['scale'] = length * 0.9
+    arrow_points['avg_score'] = np.array([G.edges[edge].get('avg_score', np.nan) for edge in edge_list], dtype=float)
+    arrow_mesh = arrow_points.glyph(orient='direction', scale='scale', factor=1.0,
+                                    geom=pv.Arrow(shaft_radius=0.01, tip_radius=0.05))
+
+    return node_mesh, edge_mesh, arrow_mesh, node_positions
+
+@profiled('render')
+def plot_top_joke_network(best_preceding_jokes, top_n=20, seed=0, layout_cache='cache', screenshot=None):
     """
     Plot a 3D network graph showing the top scoring jokes and their good preceding jokes, with directional arrows.
+    With a screenshot path the scene is rendered off-screen and saved there instead of being shown.
     """
-    # Select the top 20 scoring jokes
-    top_jokes = best_preceding_jokes.nlargest(20, 'count')
+    # Select the top N scoring jokes
+    top_jokes = best_preceding_jokes.nlargest(top_n, 'count')
 
-    # Create a directed graph
+    # Create a directed graph with an edge between every top joke and its preceding joke
     G = nx.DiGraph()
+    G.add_edges_from((row.preceding_jokeid, row.current_jokeid, {'avg_score': row.avg_score})
+                     for row in top_jokes.itertuples(index=False))
+    print(f"added {G.number_of_edges()} edges between {G.number_of_nodes()} jokes")
 
-    # Add edges between top jokes and their preceding jokes
-    for _, row in top_jokes.iterrows():
-        print("adding edge btwn :: " + str(row['preceding_jokeid'] + " -> " + str(row['current_jokeid'])))
-        G.add_edge(row['preceding_jokeid'], row['current_jokeid'])
-
-    # Use spring layout to position nodes in 3D
-    pos = nx.spring_layout(G, dim=3, k=0.7, iterations=100)
-
-    # Extract node positions as a list of coordinates
-    node_positions = np.array([pos[node] for node in G.nodes()])
+    # Position nodes in 3D with the cached, sparse force-directed layout
+    pos = layout_graph(G, dim=3, seed=seed, cache_dir=layout_cache)
 
-    # Create a PyVista plotter
-    plotter = pv.Plotter()
+    node_mesh, edge_mesh, arrow_mesh, node_positions = build_network_meshes(G, pos)
 
-    # Add nodes as spheres
-    for i, node in enumerate(G.nodes()):
-        plotter.add_mesh(pv.Sphere(center=(node_positions[i][0], node_positions[i][1], node_positions[i][2]), radius=0.05), color='skyblue')
-
-    # Create edges and add them to the plotter with arrows
-    for edge in G.edges():
-        start = np.array(pos[edge[0]])
-        end = np.array(pos[edge[1]])
-
-        # Add line for the edge
-        plotter.add_lines(np.array([start, end]), color='blue', width=2)
-
-        # Compute the direction and length of the edge
-        direction = end - start
-        length = np.linalg.norm(direction)
-
-        # Normalize the direction vector
-        direction = direction / length
-
-        # Scale the arrow based on the edge length (adjusting scale factor as needed)
-        arrow = pv.Arrow(start, direction, scale=length * 0.9, shaft_radius=0.01, tip_radius=0.05)
-
-        plotter.add_mesh(arrow, color='red')
+    # Create a PyVista plotter and add the nodes, edges and arrows as three actors
+    plotter = pv.Plotter(off_screen=screenshot is not None)
+    plotter.add_mesh(node_mesh, color='skyblue')
+    plotter.add_mesh(edge_mesh, color='blue', line_width=2)
+    plotter.add_mesh(arrow_mesh, scalars='avg_score', cmap='Reds', show_scalar_bar=False)
 
     # Offset the labels slightly from the nodes for better visibility
     offset = 0.1  # Adjust this value to move labels further away from the nodes
@@ -126,57 +145,41 @@ def plot_top_joke_network(best_preceding_jokes):
 
     plotter.set_background("skyblue")  # You can also use colors like "white", "black", or RGB values (1.0, 1.0, 1.0)
     
-    # Show the plot interactively
-    plotter.show()
+    # Show the plot interactively, or save it when rendering off-screen
+    if screenshot is not None:
+        plotter.screenshot(screenshot)
+        plotter.close()
+    else:
+        plotter.show()
 
 def main():
     # Argument parser for command-line arguments
     parser = argparse.ArgumentParser(description="Analyze jokes and plot joke networks.")
-    parser.add_argument('--password', required=True, help='Password for MySQL database')
+    parser.add_argument('--top', type=int, default=20, help='Number of most frequent joke pairings to plot')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for the network layout')
+    parser.add_argument('--screenshot', help='Render off-screen and save the network to this image instead of showing it')
+    parser.add_argument('--intervals', choices=['bootstrap', 'shrinkage'], default='bootstrap', help='How to compute the score intervals of joke pairings')
+    parser.add_argument('--resamples', type=int, default=1000, help='Number of bootstrap resamples per joke pairing')
+    parser.add_argument('--prior_weight', type=float, default=5.0, help='Pseudo-observations shrinking rare pairings towards the overall average score')
+    add_source_arguments(parser)
+    add_profile_arguments(parser)
 
     args = parser.parse_args()
+    enable_from_args(args)
 
-    # Connect to MySQL database using provided password
-    conn = mysql.connector.connect(
-        host="localhost",
-        user="root",
-        password=args.password,
-        database="jokes"
-    )
-
-    # Run the updated SQL query to get the data
-    query = """
-    SELECT j1.jokeid AS current_jokeid, j1.score AS current_score, j2.jokeid AS preceding_jokeid
-    FROM jokes j1
-    LEFT JOIN jokes j2
-    ON j1.date = j2.date AND j1.venue = j2.venue AND j1.id = j2.id + 1
-    WHERE j1.jokeid IN (
-        SELECT jokeid
-        FROM jokes
-        GROUP BY jokeid
-        HAVING COUNT(*) >= 10
-    )
-    AND j2.jokeid IN (
-        SELECT jokeid
-        FROM jokes
-        GROUP BY jokeid
-        HAVING COUNT(*) >= 10
-    )
-    AND j1.score IS NOT NULL;
-    """
-    df = pd.read_sql(query, conn)
+    # Load the jokes table and pair every joke with the joke performed right before it
+    jokes = load_jokes_from_args(args)
+    df = preceding_joke_pairs(jokes, cache_dir=os.path.dirname(args.cache))
 
     # Apply fuzzy grouping
     df = fuzzy_group_jokes(df)
 
     # Analyze the jokes and get the best preceding jokes
-    best_preceding_jokes = analyze_jokes(df)
+    best_preceding_jokes = analyze_jokes(df, args.intervals, args.resamples, args.prior_weight, args.seed)
 
     # Plot the network graph of top scoring jokes and their preceding jokes
-    plot_top_joke_network(best_preceding_jokes)
-
-    # Close the database connection
-    conn.close()
+    plot_top_joke_network(best_preceding_jokes, top_n=args.top, seed=args.seed, layout_cache=os.path.dirname(args.cache),
+                          screenshot=args.screenshot)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,147 @@
+import matplotlib
+matplotlib.use('Agg')
+
+import matplotlib.pyplot as plt
+import pandas as pd
+import argparse
+import hashlib
+import logging
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from joke_clustering import update_alias_table
+from joke_companions import companion_frequencies, companions_path, save_companions
+from joke_cooccurrence import dense_block
+from joke_aggregates import top_groups
+from joke_data import add_source_arguments, load_jokes_from_args
+from profiling import add_profile_arguments, enable_from_args, stage
+import bike_stats
+import joke_stats
+import top_20
+
+def _file_name(prefix, jokeid, used):
+    """
+    File-system safe, unique name for a jokeid's figure.
+    """
+    name = f"{prefix}_{re.sub(r'[^A-Za-z0-9_.-]', '_', jokeid)}"
+    if name in used:
+        name += '_' + hashlib.sha1(jokeid.encode()).hexdigest()[:8]
+    used.add(name)
+    return name
+
+def joke_specs(jokes, alias_table, top_n=20, min_count=10, top_companions=30, cache_dir='cache'):
+    """
+    Build the figure specs for the joke reports from the precomputed aggregates: one companion chart per
+    jokeid and one pairing heatmap of the top N jokeid groups.
+    """
+    specs = []
+
+    # Companions of every jokeid, read from the batch table when it is up to date
+    jokeid_to_group = update_alias_table(jokes['jokeid'].cat.categories, alias_table)
+    path = companions_path(jokes, jokeid_to_group, cache_dir)
+    if os.path.exists(path):
+        companions = pd.read_parquet(path)
+    else:
+        companions = companion_frequencies(jokes, jokeid_to_group)
+        save_companions(companions, path)
+
+    used = set()
+    for jokeid, rows in companions.groupby('jokeid', sort=True, observed=True):
+        specs.append({'kind': 'companions', 'name': _file_name('companions', jokeid, used),
+                      'jokeid': jokeid, 'companions': rows.nlargest(top_companions, 'share_low')})
+
+    # Pairing heatmap of the top scoring jokeid groups
+    pair_sums, pair_counts, groups, group_stats = top_20.pair_scores(jokes, jokeid_to_group, alias_table, cache_dir)
+    top_jokeids = top_groups(group_stats, top_n, by='mean', min_count=min_count)
+    specs.append({'kind': 'heatmap', 'name': 'jokes_heatmap_analysis',
+                  'score_matrix': dense_block(pair_sums, pair_counts, groups, top_jokeids), 'jokeids': top_jokeids})
+    return specs
+
+def network_spec(jokes, top_n=20, cache_dir='cache'):
+    """
+    Build the figure spec of the 3D joke network, rendered off-screen with PyVista. The transition table and
+    the graph layout are cached under cache_dir.
+    """
+    import pyviz_joke_stats
+    from joke_transitions import preceding_joke_pairs
+
+    best_preceding_jokes = pyviz_joke_stats.analyze_jokes(pyviz_joke_stats.fuzzy_group_jokes(preceding_joke_pairs(jokes, cache_dir=cache_dir)))
+    return {'kind': 'network', 'name': 'joke_network', 'best_preceding_jokes': best_preceding_jokes, 'top_n': top_n,
+            'cache_dir': cache_dir}
+
+def render(spec, out_dir, formats):
+    """
+    Render one figure spec and save it in every requested format. Runs in a worker process.
+    """
+    base = os.path.join(out_dir, spec['name'])
+    paths = [f"{base}.{fmt}" for fmt in formats]
+
+    if spec['kind'] == 'network':
+        import pyviz_joke_stats
+        paths = [f"{base}.png"]
+        pyviz_joke_stats.plot_top_joke_network(spec['best_preceding_jokes'], top_n=spec['top_n'],
+                                               layout_cache=spec['cache_dir'], screenshot=paths[0])
+        return paths
+
+    if spec['kind'] == 'companions':
+        joke_stats.plot_companions(spec['jokeid'], spec['companions'], path=paths[0])
+    elif spec['kind'] == 'heatmap':
+        top_20.plot_heatmap(spec['score_matrix'], spec['jokeids'], path=paths[0])
+    elif spec['kind'] == 'bike':
+        bike_stats.plot_dashboard(spec['aggregates'], path=paths[0])
+    else:
+        raise ValueError(f"Unknown figure kind '{spec['kind']}'")
+
+    for path in paths[1:]:
+        plt.savefig(path)
+    plt.close('all')
+    return paths
+
+def render_all(specs, out_dir, formats=('png',), workers=None):
+    """
+    Render every figure spec in a process pool and return the paths written.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    chunksize = max(1, len(specs) // (4 * (workers or os.cpu_count() or 1)))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        rendered = executor.map(render, specs, [out_dir] * len(specs), [formats] * len(specs), chunksize=chunksize)
+        return [path for paths in rendered for path in paths]
+
+def main():
+    parser = argparse.ArgumentParser(description='Render every report figure headless, in parallel.')
+    parser.add_argument('--out', default='reports', help='Directory to write the figures to.')
+    parser.add_argument('--format', nargs='+', default=['png'], choices=['png', 'svg', 'pdf'], help='Image formats to write.')
+    parser.add_argument('--workers', type=int, help='Number of rendering processes (default: all cores).')
+    parser.add_argument('--alias_table', default='joke_aliases.json', help='Path of the persisted jokeid alias table.')
+    parser.add_argument('--top', type=int, default=20, help='Number of top scoring jokeid groups in the heatmap and pairings in the network.')
+    parser.add_argument('--min_count', type=int, default=10, help='Minimum number of scored performances for a heatmap jokeid group.')
+    parser.add_argument('--network', action='store_true', help='Also render the 3D joke network off-screen with PyVista.')
+    parser.add_argument('--bike_csv', help='Also render the cyclist dashboard from this CSV export.')
+    parser.add_argument('--bike_parquet', help='Also render the cyclist dashboard from this Parquet dataset.')
+    add_source_arguments(parser)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(filename='report.log', level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    enable_from_args(args)
+
+    jokes = load_jokes_from_args(args)
+    specs = joke_specs(jokes, args.alias_table, args.top, args.min_count, cache_dir=os.path.dirname(args.cache))
+    if args.network:
+        specs.append(network_spec(jokes, args.top, os.path.dirname(args.cache)))
+    if args.bike_parquet:
+        specs.append({'kind': 'bike', 'name': 'cyclist_accidents_analysis', 'aggregates': bike_stats.load_parquet(args.bike_parquet)})
+    elif args.bike_csv:
+        specs.append({'kind': 'bike', 'name': 'cyclist_accidents_analysis', 'aggregates': bike_stats.load_in_memory(args.bike_csv)})
+
+    logging.info("Rendering %d figures with %s workers...", len(specs), args.workers or 'all')
+    with stage('render_all', figures=len(specs)) as record:
+        paths = render_all(specs, args.out, args.format, args.workers)
+        record.rows = len(paths)
+    logging.info("Wrote %d files to %s.", len(paths), args.out)
+    print(f"Wrote {len(paths)} files to {args.out}")
+
+if __name__ == "__main__":
+    main()
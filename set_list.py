@@ -0,0 +1,41 @@
+from joke_clustering import update_alias_table
+from joke_data import add_source_arguments, load_jokes_from_args
+from joke_sequences import load_model, propose_set_list
+from profiling import add_profile_arguments, enable_from_args
+import argparse
+import logging
+import os
+
+def main():
+    # Set up command-line argument parsing
+    parser = argparse.ArgumentParser(description='Propose a high-scoring running order for a list of jokes.')
+    parser.add_argument('jokeids', nargs='+', help='The jokeids to put in order (e.g. "AI_killing_poetry stroller").')
+    parser.add_argument('--length', type=int, help='Only pick this many of the jokes (default: all of them).')
+    parser.add_argument('--beam', type=int, default=64, help='Number of partial set lists kept at every step.')
+    parser.add_argument('--prior_weight', type=float, default=5.0, help='Pseudo-observations shrinking rare joke sequences towards shorter ones.')
+    parser.add_argument('--alias_table', type=str, default='joke_aliases.json', help='Path of the persisted jokeid alias table.')
+    add_source_arguments(parser)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    # Set up logging to write to a file
+    logging.basicConfig(filename='jokes_analysis.log',
+                        level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    enable_from_args(args)
+
+    # Map the history and the requested jokeids to their canonical groups; unknown jokeids score the overall mean
+    jokes = load_jokes_from_args(args)
+    jokeid_to_group = update_alias_table(jokes['jokeid'].cat.categories, args.alias_table)
+    sequences, tables = load_model(jokes, jokeid_to_group, os.path.dirname(args.cache))
+
+    candidates = [jokeid_to_group.get(jokeid, jokeid) for jokeid in args.jokeids]
+    set_list = propose_set_list(tables, sequences['groups'], candidates, args.length, args.beam, args.prior_weight)
+
+    print("Proposed set list (expected score given the jokes before it):")
+    for position, (group, expected) in enumerate(set_list, 1):
+        print(f"{position:3d}. {group:40s} {expected:.2f}")
+    print(f"Total expected score: {sum(expected for _, expected in set_list):.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import os
+import string
+
+import numpy as np
+import pandas as pd
+
+from joke_data import JOKE_COLUMNS, typed_frame
+
+BOROUGHS = ['BROOKLYN', 'MANHATTAN', 'QUEENS', 'BRONX', 'STATEN ISLAND']
+FACTORS = [
+    'Driver Inattention/Distraction', 'Unspecified', 'Failure to Yield Right-of-Way',
+    'Pedestrian/Bicyclist/Other Pedestrian Error/Confusion', 'Traffic Control Disregarded',
+    'Passing or Lane Usage Improper', 'Unsafe Speed', 'Following Too Closely', 'Other Vehicular',
+    'Backing Unsafely', 'Driver Inexperience', 'View Obstructed/Limited',
+]
+
+
+def _zipf_choice(rng, n_items, size, exponent=1.1):
+    """
+    Draw item indices with a Zipf-like popularity skew: item 0 is the most common.
+    """
+    weights = 1.0 / np.arange(1, n_items + 1) ** exponent
+    return rng.choice(n_items, size=size, p=weights / weights.sum())
+
+
+def _joke_names(rng, n_jokes):
+    """
+    Distinct jokeids of one to three random words joined by underscores, like 'AI_killing_poetry'.
+    """
+    letters = np.array(list(string.ascii_lowercase))
+    words = np.array([''.join(letters[rng.integers(0, 26, size=length)]) for length in rng.integers(3, 9, size=n_jokes * 2)])
+    picks = rng.integers(0, len(words), size=(n_jokes * 2, 3))
+    lengths = rng.integers(1, 4, size=n_jokes * 2)
+    names = {'_'.join(words[pick[:length]]) for pick, length in zip(picks, lengths)}
+    return sorted(names)[:n_jokes]
+
+
+def _typo(rng, jokeid):
+    """
+    A misspelt or annotated variant of a jokeid, the kind of noise the fuzzy matchers deal with.
+    """
+    kind = rng.integers(0, 5)
+    position = rng.integers(0, len(jokeid))
+    letter = rng.choice(list(string.ascii_lowercase))
+    if kind == 0:
+        return jokeid[:position] + jokeid[position + 1:] or jokeid
+    if kind == 1:
+        return jokeid[:position] + letter + jokeid[position:]
+    if kind == 2:
+        return jokeid[:position] + letter + jokeid[position + 1:]
+    if kind == 3:
+        return jokeid + ' (orig)'
+    return jokeid + '_' + str(rng.integers(2, 5))
+
+
+def generate_jokes(n_rows, n_jokes=None, n_venues=None, typo_rate=0.03, null_score_rate=0.01, seed=0):
+    """
+    Generate a realistic jokes table with about n_rows performances, in the same typed, columnar
+    layout load_jokes returns. Sets (date + venue) have a Poisson number of jokes, joke popularity and
+    venues are Zipf-skewed, recent dates are more frequent, and a fraction of jokeids are misspelt.
+    """
+    rng = np.random.default_rng(seed)
+    # Defaults scale like the real table: ~2000 jokeids and ~250 venues for 13k rows
+    n_jokes = n_jokes or max(50, int(n_rows ** 0.8))
+    n_venues = n_venues or max(5, int(n_rows ** 0.58))
+
+    names = rng.permutation(np.array(_joke_names(rng, n_jokes), dtype=object))
+    venues = np.array([f"venue{i}" for i in range(n_venues)], dtype=object)
+    quality = rng.normal(3.8, 0.6, size=len(names))
+
+    # Split the rows into sets of a Poisson number of jokes
+    set_sizes = np.clip(rng.poisson(11, size=n_rows // 5 + 1), 1, 75)
+    set_sizes = set_sizes[np.cumsum(set_sizes) <= n_rows]
+    n_sets = len(set_sizes)
+    n = int(set_sizes.sum())
+
+    # Recent dates are more frequent; one venue per set
+    days = (3650 * rng.power(3, size=n_sets)).astype(int)
+    set_dates = np.datetime64('2012-01-01') + days.astype('timedelta64[D]')
+    set_venues = venues[_zipf_choice(rng, n_venues, n_sets)]
+
+    jokes = _zipf_choice(rng, len(names), n, 0.8)
+    jokeids = names[jokes].copy()
+    typos = np.flatnonzero(rng.random(n) < typo_rate)
+    jokeids[typos] = [_typo(rng, jokeid) for jokeid in jokeids[typos]]
+
+    scores = np.clip(np.round(quality[jokes] + rng.normal(0, 0.8, size=n)), 0, 5).astype(object)
+    scores[rng.random(n) < null_score_rate] = None
+
+    columns = {
+        'id': np.arange(1, n + 1),
+        'jokeid': jokeids,
+        'date': np.repeat(set_dates, set_sizes).astype(str),
+        'score': scores,
+        'venue': np.repeat(set_venues, set_sizes),
+        'time': [None] * n,
+    }
+    return typed_frame({column: columns[column] for column in JOKE_COLUMNS})
+
+
+def generate_crashes(path, n_rows, chunk_rows=1_000_000, seed=0):
+    """
+    Write a cyclist-crash CSV of n_rows in the layout bike_stats.py reads, in chunks so exports of
+    tens of millions of rows can be generated without holding them in memory.
+    """
+    rng = np.random.default_rng(seed)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    # Crash hours peak in the evening commute
+    hour_weights = np.array([2, 1, 1, 1, 1, 2, 4, 6, 8, 7, 6, 7, 8, 8, 9, 11, 12, 12, 11, 9, 7, 5, 4, 3], dtype=float)
+    hour_weights /= hour_weights.sum()
+
+    written = 0
+    while written < n_rows:
+        n = min(chunk_rows, n_rows - written)
+        dates = np.datetime64('2016-01-01') + rng.integers(0, 8 * 365, size=n).astype('timedelta64[D]')
+        hours = rng.choice(24, size=n, p=hour_weights)
+        minutes = rng.integers(0, 60, size=n)
+        chunk = pd.DataFrame({
+            'Date': pd.to_datetime(dates).strftime('%m/%d/%Y'),
+            'Time': [f"{h:02d}:{m:02d}:00" for h, m in zip(hours, minutes)],
+            'Borough': np.array(BOROUGHS + [None], dtype=object)[_zipf_choice(rng, len(BOROUGHS) + 1, n, 0.6)],
+            'Cyclists Injured': rng.poisson(0.8, size=n),
+            'Cyclists Killed': (rng.random(n) < 0.004).astype(int),
+            'Latitude': np.round(40.5 + rng.beta(4, 4, size=n) * 0.4, 6),
+            'Longitude': np.round(-74.2 + rng.beta(4, 4, size=n) * 0.5, 6),
+            'Contributing Factor': np.array(FACTORS, dtype=object)[_zipf_choice(rng, len(FACTORS), n)],
+        })
+        chunk.to_csv(path, mode='w' if written == 0 else 'a', header=written == 0, index=False)
+        written += n
+    return path
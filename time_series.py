@@ -0,0 +1,111 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# Lengths accepted by parse_window's last, e.g. '6M' for six months or '2W' for two weeks
+_LAST = re.compile(r'^\s*(\d+)\s*([DWMY])\s*$', re.IGNORECASE)
+_UNITS = {'D': 'days', 'W': 'weeks', 'M': 'months', 'Y': 'years'}
+
+
+def parse_window(start=None, end=None, last=None, latest=None):
+    """
+    Resolve a half-open [start, end) date window; None leaves that side open. start and end are anything
+    pd.Timestamp accepts. last ('6M', '30D', '2W', '1Y') is the length of the window ending at end, or at
+    the day after latest (the last date in the data) when no end is given.
+    """
+    start = pd.Timestamp(start) if start is not None else None
+    end = pd.Timestamp(end) if end is not None else None
+    if last is not None:
+        match = _LAST.match(last)
+        if not match:
+            raise ValueError(f"Invalid window length '{last}' (expected e.g. 6M, 30D, 2W or 1Y)")
+        if end is None and latest is not None:
+            end = pd.Timestamp(latest).normalize() + pd.Timedelta(days=1)
+        if end is None:
+            raise ValueError("A window length needs an end date or the last date of the data")
+        start = end - pd.DateOffset(**{_UNITS[match.group(2).upper()]: int(match.group(1))})
+    return start, end
+
+
+def period_window(start=None, end=None, freq='W'):
+    """
+    Widen a [start, end) window to whole periods of freq, so the first and last periods of a resample hold
+    every day the data has for them instead of a part that would be averaged as a full period.
+    """
+    if start is not None:
+        start = pd.Period(pd.Timestamp(start), freq=freq).start_time
+    if end is not None:
+        end = (pd.Period(pd.Timestamp(end) - pd.Timedelta(days=1), freq=freq) + 1).start_time
+    return start, end
+
+
+def sort_by_date(frame, column, tiebreak=None):
+    """
+    The rows of frame that have a date, sorted by it (then by the tiebreak column) so windows can be found
+    by binary search.
+    """
+    frame = frame[frame[column].notna()]
+    keys = [column] if tiebreak is None else [column, tiebreak]
+    return frame.sort_values(keys, kind='stable', ignore_index=True)
+
+
+def window_bounds(dates, start=None, end=None):
+    """
+    Positions [lo, hi) of the [start, end) window in a sorted datetime64 array, by binary search.
+    """
+    dates = np.asarray(dates)
+    lo = 0 if start is None else int(np.searchsorted(dates, pd.Timestamp(start).to_datetime64().astype(dates.dtype), side='left'))
+    hi = len(dates) if end is None else int(np.searchsorted(dates, pd.Timestamp(end).to_datetime64().astype(dates.dtype), side='left'))
+    return lo, max(lo, hi)
+
+
+def window(frame, column, start=None, end=None):
+    """
+    The rows of a frame sorted by column that fall in the [start, end) window, as a slice.
+    """
+    lo, hi = window_bounds(frame[column].to_numpy(), start, end)
+    return frame.iloc[lo:hi]
+
+
+def resample(dates, values, freq='W', groups=None, n_groups=1, start=None, end=None):
+    """
+    Sum and count values per calendar period (a pandas period frequency such as 'D', 'W', 'M', 'Q' or 'Y')
+    and, when group codes are given, per group, in one bincount. Periods are located by binary search of
+    every date in the period start times; NaN values are left out of both the sums and the counts.
+    Every period from start (or the first date) to end (or the last date) is returned, empty ones included.
+    Returns (periods, sums, counts) with sums and counts of shape (n_periods, n_groups).
+    """
+    dates = pd.DatetimeIndex(dates)
+    values = np.asarray(values, dtype=np.float64)
+    first = start if start is not None else dates.min()
+    last = (pd.Timestamp(end) - pd.Timedelta(days=1)) if end is not None else dates.max()
+    if len(dates) == 0 and (start is None or end is None):
+        return pd.PeriodIndex([], freq=freq), np.zeros((0, n_groups)), np.zeros((0, n_groups), dtype=np.int64)
+    periods = pd.period_range(first, last, freq=freq)
+
+    # Start times of every period and of the one after the last, so dates past the end fall outside
+    edges = periods.append(pd.PeriodIndex([periods[-1] + 1])).start_time.to_numpy().astype(dates.dtype) if len(periods) else np.zeros(1, dtype=dates.dtype)
+    bucket = np.searchsorted(edges, dates.to_numpy(), side='right') - 1
+    groups = np.zeros(len(dates), dtype=np.int64) if groups is None else np.asarray(groups, dtype=np.int64)
+    valid = (bucket >= 0) & (bucket < len(periods)) & ~np.isnan(values) & (groups >= 0)
+    cells = bucket[valid] * n_groups + groups[valid]
+    size = len(periods) * n_groups
+    sums = np.bincount(cells, weights=values[valid], minlength=size)[:size].reshape(len(periods), n_groups)
+    counts = np.bincount(cells, minlength=size)[:size].reshape(len(periods), n_groups)
+    return periods, sums, counts
+
+
+def rolling_mean(sums, counts, periods):
+    """
+    Mean over the last periods (>= 1) periods, the current one included, from per-period sums and counts,
+    read off cumulative sums. NaN where the window holds no values.
+    """
+    if periods < 1:
+        raise ValueError(f"A rolling mean needs at least 1 period, got {periods}")
+    sums = np.cumsum(np.asarray(sums, dtype=np.float64), axis=0)
+    counts = np.cumsum(np.asarray(counts, dtype=np.float64), axis=0)
+    sums[periods:] = sums[periods:] - sums[:-periods].copy()
+    counts[periods:] = counts[periods:] - counts[:-periods].copy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan)
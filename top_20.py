@@ -1,131 +1,146 @@
-import mysql.connector
 import matplotlib.pyplot as plt
 import seaborn as sns
-import numpy as np
-from collections import Counter
-from rapidfuzz import fuzz, process
+from joke_clustering import update_alias_table
+from joke_data import add_source_arguments, data_version, load_jokes_from_args
+from joke_aggregates import group_score_stats, top_groups
+from joke_encoding import alias_digest, encode_groups
+from joke_cooccurrence import encode_sets, build_cooccurrence, save_cooccurrence, load_cooccurrence, dense_block
+import joke_incremental
+from profiling import add_profile_arguments, enable_from_args, profiled
 import logging
-
-# Set up logging to write to a file
-logging.basicConfig(filename='jokes_analysis.log',
-                    level=logging.INFO,
-                    format='%(asctime)s - %(levelname)s - %(message)s')
-
-# Connect to the MySQL database
-logging.info("Connecting to the database...")
-connection = mysql.connector.connect(
-    host='localhost',
-    user='root',
-    password='',
-    database='jokes'
-)
-
-cursor = connection.cursor()
-
-# Updated SQL query to exclude rows with NULL scores
-query = """
-SELECT jokeid, date, venue, score
-FROM jokes
-WHERE score IS NOT NULL;
-"""
-
-logging.info("Executing SQL query to retrieve jokes data...")
-cursor.execute(query)
-
-# Store the results
-results = cursor.fetchall()
-logging.info(f"Retrieved {len(results)} rows from the database.")
-
-# Close the database connection
-cursor.close()
-connection.close()
-logging.info("Database connection closed.")
-
-# Process the results to find frequently occurring jokeids
-joke_sets = {}
-for row in results:
-    jokeid, date, venue, score = row
-    key = (date, venue)
-    if key not in joke_sets:
-        joke_sets[key] = []
-    joke_sets[key].append((jokeid, score))
-
-logging.info(f"Processed {len(joke_sets)} unique joke sets (venue + date).")
-
-# Fuzzy matching to group similar jokeids
-def combine_similar_jokeids(jokeids, similarity_threshold=80):
-    grouped_jokeids = {}
-    for jokeid in jokeids:
-        match = process.extractOne(jokeid, grouped_jokeids.keys(), scorer=fuzz.ratio)
-        logging.debug(f"Processing jokeid: {jokeid}")
-        
-        if match is not None:
-            best_match, score = match[0], match[1]
-            logging.debug(f"Best match for {jokeid}: {best_match} with score {score}")
-            if score >= similarity_threshold:
-                grouped_jokeids[best_match].append(jokeid)
-                logging.debug(f"Grouped {jokeid} with {best_match}")
-            else:
-                grouped_jokeids[jokeid] = [jokeid]
-                logging.debug(f"Created new group for {jokeid}")
-        else:
-            grouped_jokeids[jokeid] = [jokeid]
-            logging.debug(f"No match found for {jokeid}, created new group.")
-    return grouped_jokeids
-
-# Combine jokeids based on similarity
-jokeids = [row[0] for row in results]
-logging.info("Combining similar jokeids based on fuzzy matching...")
-similar_jokeid_groups = combine_similar_jokeids(jokeids)
-logging.info(f"Found {len(similar_jokeid_groups)} unique jokeid groups.")
-
-# Calculate average scores for similar jokeid groups
-average_scores = {}
-for group, similar_jokes in similar_jokeid_groups.items():
-    total_score = sum(score for jokeid in similar_jokes for jokeid_data in results if jokeid == jokeid_data[0] for score in [jokeid_data[3]])
-    avg_score = total_score / len(similar_jokes)
-    average_scores[group] = avg_score
-
-logging.info(f"Calculated average scores for {len(average_scores)} groups.")
-
-# Extract the top 20 jokeid groups based on average score for heatmap analysis
-top_jokeids = [jokeid for jokeid, _ in sorted(average_scores.items(), key=lambda item: item[1], reverse=True)[:20]]
-
-# Create a mapping from jokeid to index
-jokeid_to_index = {jokeid: idx for idx, jokeid in enumerate(top_jokeids)}
-
-# Create a score matrix for the top 20 jokeids
-score_matrix = np.zeros((len(top_jokeids), len(top_jokeids)))
-
-# Populate the score matrix based on co-occurrence in the same sets (venue + date)
-for joke_set in joke_sets.values():
-    for i, (jokeid1, score1) in enumerate(joke_set):
-        if jokeid1 in top_jokeids:
-            for jokeid2, score2 in joke_set[i+1:]:
-                if jokeid2 in top_jokeids:
-                    idx1, idx2 = jokeid_to_index[jokeid1], jokeid_to_index[jokeid2]
-                    if (idx1 == idx2):
-                        avg_score = 0
-                    else:
-                        avg_score = (score1 + score2) / 2  # Average score for co-occurrence
-                    score_matrix[idx1, idx2] = avg_score
-                    score_matrix[idx2, idx1] = avg_score  # Symmetric matrix
-
-# Plot the heatmap with larger figure size and improved readability
-plt.figure(figsize=(12, 10))
-sns.heatmap(score_matrix, annot=True, fmt=".1f", cmap="YlGnBu",
-            xticklabels=top_jokeids, yticklabels=top_jokeids, linewidths=.5)
-
-plt.title("Heatmap of Joke Scores for Top 20 JokeIDs")
-plt.xlabel("JokeID")
-plt.ylabel("JokeID")
-plt.xticks(rotation=45, ha='right')  # Rotate x-axis labels for better readability
-plt.tight_layout()
-
-# Save the plot to a file
-plt.savefig('jokes_heatmap_analysis_fixed.png')
-logging.info("Heatmap saved as 'jokes_heatmap_analysis_fixed.png'.")
-
-# Show the plot
-logging.info("Displaying the heatmap for top jokeid groups...")
-plt.show()
+import argparse
+import os
+
+@profiled('pair_scores')
+def build_pair_scores(jokes, alias_table='joke_aliases.json', recluster=False):
+    """
+    Group similar jokeids and build the per-group score statistics and the co-occurrence matrices of
+    every pair of groups. Returns (pair_sums, pair_counts, groups, group_stats).
+    """
+    # Keep only rows with a score
+    results = jokes[jokes['score'].notna()]
+    logging.info("Retrieved %d scored rows.", len(results))
+
+    # Integer-encode the joke sets (venue + date) each row belongs to
+    set_codes = encode_sets(results['date'], results['venue'])
+    logging.info("Processed %d unique joke sets (venue + date).", set_codes.max() + 1 if len(set_codes) else 0)
+
+    # Combine jokeids based on similarity; only the distinct jokeids are matched, rows keep their int codes
+    logging.info("Combining similar jokeids based on fuzzy matching...")
+    jokeid_to_group = update_alias_table(jokes['jokeid'].cat.categories, alias_table, recluster=recluster)
+    codes, groups = encode_groups(results['jokeid'], jokeid_to_group)
+    logging.info("Found %d unique jokeid groups.", len(groups))
+
+    # Calculate count, mean and variance of the scores for every jokeid group in one pass
+    scores = results['score'].to_numpy(dtype=float)
+    group_stats = group_score_stats(codes, scores, groups)
+
+    logging.info("Calculated average scores for %d groups.", len(group_stats))
+
+    # Build sum and count matrices for every pair of jokeid groups that shared a set
+    pair_sums, pair_counts = build_cooccurrence(set_codes, codes, scores, len(groups))
+    return pair_sums, pair_counts, groups, group_stats
+
+def pair_scores(jokes, jokeid_to_group, alias_table='joke_aliases.json', cache_dir='cache'):
+    """
+    Pair scores and per-group stats of the jokeid groups, from the precomputed aggregates: the incremental
+    store when it has folded in every row of jokes, else the co-occurrence matrices cached under cache_dir
+    for this version of the data and alias mapping, built and saved on first use.
+    Returns (pair_sums, pair_counts, groups, group_stats).
+    """
+    store_path = os.path.join(cache_dir, os.path.basename(joke_incremental.DEFAULT_STORE_PATH))
+    if len(jokes) and os.path.exists(store_path):
+        store = joke_incremental.load_store(store_path)
+        if store['high_water_id'] == int(jokes['id'].max()):
+            logging.info("Reading pair scores from the aggregate store %s.", store_path)
+            pair_sums, pair_counts, groups = joke_incremental.group_cooccurrence(store, jokeid_to_group)
+            return pair_sums, pair_counts, groups, joke_incremental.group_stats(store, jokeid_to_group)
+
+    path = os.path.join(cache_dir, f"cooccurrence-{data_version(jokes)}-{alias_digest(jokeid_to_group)}.npz")
+    if os.path.exists(path):
+        logging.info("Reading pair scores from %s.", path)
+        return load_cooccurrence(path)
+    pair_sums, pair_counts, groups, group_stats = build_pair_scores(jokes, alias_table)
+    os.makedirs(cache_dir or '.', exist_ok=True)
+    save_cooccurrence(path + '.tmp.npz', pair_sums, pair_counts, groups, group_stats)
+    os.replace(path + '.tmp.npz', path)
+    return pair_sums, pair_counts, groups, group_stats
+
+@profiled('render')
+def plot_heatmap(score_matrix, top_jokeids, path='jokes_heatmap_analysis_fixed.png'):
+    """
+    Plot the average pair scores of the selected jokeid groups as a heatmap and save it.
+    """
+    # Plot the heatmap with larger figure size and improved readability
+    plt.figure(figsize=(12, 10))
+    sns.heatmap(score_matrix, annot=len(top_jokeids) <= 30, fmt=".1f", cmap="YlGnBu",
+                xticklabels=top_jokeids, yticklabels=top_jokeids, linewidths=.5)
+
+    plt.title(f"Heatmap of Joke Scores for Top {len(top_jokeids)} JokeIDs")
+    plt.xlabel("JokeID")
+    plt.ylabel("JokeID")
+    plt.xticks(rotation=45, ha='right')  # Rotate x-axis labels for better readability
+    plt.tight_layout()
+
+    # Save the plot to a file
+    plt.savefig(path)
+    logging.info("Heatmap saved as '%s'.", path)
+
+def main():
+    # Set up command-line argument parsing
+    parser = argparse.ArgumentParser(description='Heatmap of pairing scores for the top scoring jokeid groups.')
+    parser.add_argument('--alias_table', type=str, default='joke_aliases.json', help='Path of the persisted jokeid alias table.')
+    parser.add_argument('--recluster', action='store_true', help='Rebuild the alias table from scratch instead of only matching new jokeids.')
+    parser.add_argument('--min_count', type=int, default=10, help='Minimum number of scored performances for a jokeid group to be ranked.')
+    parser.add_argument('--top', type=int, default=20, help='Number of top scoring jokeid groups to show in the heatmap.')
+    parser.add_argument('--jokes', type=str, help='Comma-separated jokeid groups to show instead of the top N.')
+    parser.add_argument('--headless', action='store_true', help='Only save the heatmap, without opening a window.')
+    parser.add_argument('--store', nargs='?', const=joke_incremental.DEFAULT_STORE_PATH,
+                        help='Keep running aggregates in this store and only fold in rows added since the last run.')
+    add_source_arguments(parser)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    if args.top < 1:
+        parser.error('--top must be at least 1')
+
+    # Set up logging to write to a file
+    logging.basicConfig(filename='jokes_analysis.log',
+                        level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    enable_from_args(args)
+
+    if args.store:
+        # Fold only the rows added since the last run into the running aggregates, then group them
+        store = joke_incremental.refresh_store_from_args(args, args.store)
+        jokeid_to_group = update_alias_table(store['jokeids'], args.alias_table, recluster=args.recluster)
+        pair_sums, pair_counts, groups = joke_incremental.group_cooccurrence(store, jokeid_to_group)
+        group_stats = joke_incremental.group_stats(store, jokeid_to_group)
+    else:
+        # Load the jokes table from the selected source; the co-occurrence matrices are read from the cache
+        # for this version of the data and alias mapping, and only built when it has none yet
+        jokes = load_jokes_from_args(args)
+        jokeid_to_group = update_alias_table(jokes['jokeid'].cat.categories, args.alias_table, recluster=args.recluster)
+        pair_sums, pair_counts, groups, group_stats = pair_scores(jokes, jokeid_to_group, args.alias_table,
+                                                                  os.path.dirname(args.cache))
+
+    # Pick the jokeid groups for the heatmap: an explicit list, or the top N based on average score
+    if args.jokes:
+        # Jokeids may be given by any alias of their group
+        top_jokeids = list(dict.fromkeys(jokeid_to_group.get(jokeid, jokeid) for jokeid in args.jokes.split(',')))
+        unknown = sorted(set(top_jokeids) - set(groups))
+        if unknown:
+            parser.error(f"unknown jokeid groups: {', '.join(unknown)}")
+    else:
+        top_jokeids = top_groups(group_stats, args.top, by='mean', min_count=args.min_count)
+
+    # Slice the average pair scores for the selected groups as a dense block
+    score_matrix = dense_block(pair_sums, pair_counts, groups, top_jokeids)
+    plot_heatmap(score_matrix, top_jokeids)
+
+    # Show the plot
+    if not args.headless:
+        logging.info("Displaying the heatmap for top jokeid groups...")
+        plt.show()
+
+if __name__ == "__main__":
+    main()